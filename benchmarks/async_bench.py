@@ -0,0 +1,208 @@
+"""Compare the sync (waitress) and async (uvicorn) serving modes.
+
+Starts the app under each server in a subprocess, uvicorn both with and
+without ``ASYNC_VIEWS``, opens ``--connections`` keep-alive connections
+at once and sends ``--requests`` index requests over each of them::
+
+    python benchmarks/async_bench.py
+    python benchmarks/async_bench.py --connections 50 200 500 --threads 8
+
+For every mode and connection count it reports the requests served per
+second, the p95 latency, the connections that failed, and how much the
+server's resident memory grew per open, idle connection.
+
+All modes run Flask in ``--threads`` threads, so neither serves more
+requests at once than that; the event loop only makes waiting
+connections cheaper to hold. waitress also stops accepting connections
+beyond its ``connection_limit`` (100 by default).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+WAITRESS = """
+import json, sys
+from waitress import serve
+from sonic import create_app
+config = json.loads(sys.argv[1])
+serve(create_app(config), port=int(sys.argv[2]), threads=config["ASGI_THREADS"],
+      _quiet=True)
+"""
+UVICORN = """
+import json, sys
+import uvicorn
+from sonic.asgi import create_asgi_app
+config = json.loads(sys.argv[1])
+uvicorn.run(create_asgi_app(config), port=int(sys.argv[2]), log_level="warning")
+"""
+# Name, server script and extra config of each mode.
+MODES = (
+    ("waitress", WAITRESS, {}),
+    ("uvicorn", UVICORN, {}),
+    ("uvicorn+async", UVICORN, {"ASYNC_VIEWS": True}),
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_kib(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def get(reader, writer):
+    """Send one keep-alive GET / and read the whole response."""
+    writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    await reader.readexactly(length)
+    return status
+
+
+async def run_clients(port, pid, connections, requests, timeout):
+    """Open all the connections, then send the requests over each of them."""
+    before = rss_kib(pid)
+    opened = await asyncio.gather(
+        *(
+            asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            for _ in range(connections)
+        ),
+        return_exceptions=True,
+    )
+    streams = [s for s in opened if not isinstance(s, BaseException)]
+    # Give the server time to accept everything before reading its memory.
+    await asyncio.sleep(1)
+    held = rss_kib(pid) - before
+    latencies = []
+    failed = connections - len(streams)
+
+    async def client(reader, writer):
+        nonlocal failed
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                status = await asyncio.wait_for(get(reader, writer), timeout)
+                if status != 200:
+                    raise RuntimeError(status)
+                latencies.append(time.perf_counter() - start)
+        except (
+            OSError,
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            RuntimeError,
+        ):
+            failed += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(r, w) for r, w in streams))
+    elapsed = time.perf_counter() - start
+    for _, writer in streams:
+        writer.close()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else float("nan")
+    return {
+        "rps": len(latencies) / elapsed,
+        "p95_ms": p95 * 1000,
+        "failed": failed,
+        "kib_per_connection": held / max(len(streams), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--posts", type=int, default=2_000)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sonic-async-bench-")
+    config = {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{workdir}/bench.sqlite",
+        "TEMPLATE_CACHE_DIR": os.path.join(workdir, "jinja-cache"),
+        # Every request reads and renders its page.
+        "PAGE_CACHE_SIZE": 0,
+        "FRAGMENT_CACHE_SIZE": 0,
+        "REQUEST_LOG_SAMPLE_RATE": 0.0,
+        "RATELIMIT_ENABLED": False,
+        "ASGI_THREADS": args.threads,
+    }
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(ROOT, "benchmarks", "seed.py"),
+            "--posts",
+            str(args.posts),
+            config["SQLALCHEMY_DATABASE_URI"],
+        ],
+        cwd=ROOT,
+        capture_output=True,
+        check=True,
+    )
+
+    print(
+        f"{'mode':<14} {'connections':>11} {'req/s':>9} {'p95 ms':>9}"
+        f" {'failed':>7} {'KiB/conn':>9}"
+    )
+    for mode, code, extra in MODES:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-c", code, json.dumps({**config, **extra}), str(port)],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    socket.create_connection(("127.0.0.1", port), 1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.1)
+
+            # Warm up the templates and the database connections.
+            asyncio.run(run_clients(port, server.pid, 4, 5, args.timeout))
+            for connections in args.connections:
+                result = asyncio.run(
+                    run_clients(
+                        port, server.pid, connections, args.requests, args.timeout
+                    )
+                )
+                print(
+                    f"{mode:<14} {connections:>11} {result['rps']:>9.1f}"
+                    f" {result['p95_ms']:>9.1f} {result['failed']:>7}"
+                    f" {result['kib_per_connection']:>9.1f}"
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
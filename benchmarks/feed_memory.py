@@ -0,0 +1,82 @@
+"""Measure the memory allocated to render a page of the post feed.
+
+Seeds a throwaway database and renders the index page through the test
+client with tracemalloc running, for a few page sizes, with full post
+bodies and with ``POSTS_PREVIEW_CHARS`` previews::
+
+    python benchmarks/feed_memory.py
+    python benchmarks/feed_memory.py --per-page 20 100 --preview 300
+
+The page and fragment caches are turned off, so every request reads
+and renders all of its posts. The peak is the most memory traced at
+once during the request, which includes the rows, the rendered
+fragments and the response body.
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from seed import create_database  # noqa: E402
+from sonic import create_app  # noqa: E402
+
+
+def measure(client, url, repeat):
+    """Get the median peak of traced memory over ``repeat`` requests."""
+    peaks = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        response = client.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert response.status_code == 200, response.status_code
+        peaks.append(peak)
+    return statistics.median(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=2_000)
+    parser.add_argument("--per-page", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--preview", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sonic-feed-memory-")
+    uri = f"sqlite:///{workdir}/bench.sqlite"
+    create_database(uri, 10, args.posts)
+    logging.getLogger("sonic.request").setLevel(logging.WARNING)
+
+    print(f"{'per page':>8} {'bodies':>8} {'peak KiB':>10} {'KiB/post':>9}")
+    for preview in (None, args.preview):
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": uri,
+                "TEMPLATE_CACHE_DIR": os.path.join(workdir, "jinja-cache"),
+                "PAGE_CACHE_SIZE": 0,
+                "FRAGMENT_CACHE_SIZE": 0,
+                "POSTS_PER_PAGE_MAX": max(args.per_page),
+                "POSTS_PREVIEW_CHARS": preview,
+            }
+        )
+        app.logger.disabled = True
+        client = app.test_client()
+        for per_page in args.per_page:
+            url = f"/?per_page={per_page}"
+            client.get(url)  # warm up the templates and the connection
+            peak = measure(client, url, args.repeat)
+            label = "full" if preview is None else f"{preview} ch"
+            print(
+                f"{per_page:>8} {label:>8} {peak / 1024:>10.1f}"
+                f" {peak / 1024 / per_page:>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
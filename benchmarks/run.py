@@ -0,0 +1,362 @@
+"""Load test the app in-process and under waitress.
+
+Seeds a throwaway database, then drives the main pages with concurrent
+clients and reports throughput, latency percentiles and database
+queries per request::
+
+    python benchmarks/run.py --save benchmarks/baselines/local.json
+    python benchmarks/run.py --compare benchmarks/baselines/local.json
+
+With ``--compare`` the exit status is 1 when a scenario's p95 latency or
+throughput regressed by more than ``--threshold``. It is also 1 when a
+post listing query plan scans the post table or sorts it, see
+``flask sonic check-plans``.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+from sqlalchemy import event, text
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from seed import PASSWORD, create_database  # noqa: E402
+
+from sonic.cli import check_listing_plans  # noqa: E402
+from sonic.db import db  # noqa: E402
+
+
+class QueryCounter:
+    """Count the statements run on every engine of an app."""
+
+    def __init__(self, app):
+        self.count = 0
+        self._lock = threading.Lock()
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, "after_cursor_execute", self._count)
+
+    def _count(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+class TestClientSession:
+    """A logged in client going through the Flask test client."""
+
+    def __init__(self, app, username):
+        self.client = app.test_client()
+        if username:
+            self.post("/auth/login", {"username": username, "password": PASSWORD})
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data):
+        return self.client.post(path, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    """A logged in client talking HTTP to a real server."""
+
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect(),
+        )
+        if username:
+            self.post("/auth/login", {"username": username, "password": PASSWORD})
+
+    def _open(self, path, data=None):
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode()
+        try:
+            with self.opener.open(self.base_url + path, data, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+    def get(self, path):
+        return self._open(path)
+
+    def post(self, path, data):
+        return self._open(path, data)
+
+
+def scenarios(own_post):
+    """Map each scenario name to ``(logged_in, request)``.
+
+    :param own_post: id of a post written by the logged in user
+    """
+    return {
+        "index_anonymous": (False, lambda client, i: client.get("/")),
+        "index": (True, lambda client, i: client.get("/")),
+        "update_form": (True, lambda client, i: client.get(f"/{own_post}/update")),
+        "login": (
+            False,
+            lambda client, i: client.post(
+                "/auth/login", {"username": "user0", "password": PASSWORD}
+            ),
+        ),
+        "create": (
+            True,
+            lambda client, i: client.post(
+                "/create", {"title": f"Benchmark post {i}", "body": "Body"}
+            ),
+        ),
+    }
+
+
+def run_scenario(make_session, request, username, requests, concurrency, counter):
+    """Run ``requests`` requests split over ``concurrency`` client threads."""
+    sessions = [make_session(username) for _ in range(concurrency)]
+    per_client = requests // concurrency
+    timings = []
+    errors = []
+    lock = threading.Lock()
+
+    def client_loop(session, offset):
+        local_timings, local_errors = [], 0
+        for i in range(per_client):
+            start = time.perf_counter()
+            status = request(session, offset + i)
+            local_timings.append(time.perf_counter() - start)
+            if status >= 400:
+                local_errors += 1
+        with lock:
+            timings.extend(local_timings)
+            errors.append(local_errors)
+
+    queries_before = counter.count
+    threads = [
+        threading.Thread(target=client_loop, args=(session, n * per_client))
+        for n, session in enumerate(sessions)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    total = len(timings)
+    return {
+        "requests": total,
+        "errors": sum(errors),
+        "throughput": round(total / elapsed, 2),
+        "p50_ms": round(_percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(_percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(_percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "queries_per_request": round((counter.count - queries_before) / total, 2),
+    }
+
+
+def _percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+
+def find_own_post(app, username):
+    """Get the id of a post written by ``username`` for the update page."""
+    with app.app_context():
+        return db.session.execute(
+            text(
+                "SELECT p.id FROM post p JOIN user u ON p.author_id = u.id"
+                " WHERE u.username = :username LIMIT 1"
+            ),
+            {"username": username},
+        ).scalar()
+
+
+def run_mode(mode, app, args, counter, own_post):
+    server = None
+    if mode == "inprocess":
+
+        def make_session(username):
+            return TestClientSession(app, username)
+
+    else:
+        from waitress import create_server, wasyncore
+
+        server = create_server(
+            app, host="127.0.0.1", port=0, threads=args.threads, ident="bench"
+        )
+        server_thread = threading.Thread(target=server.run, daemon=True)
+        server_thread.start()
+        base_url = f"http://127.0.0.1:{server.effective_port}"
+
+        def make_session(username):
+            return HTTPSession(base_url, username)
+
+    results = {}
+    try:
+        for name, (logged_in, request) in scenarios(own_post).items():
+            if args.scenario and name not in args.scenario:
+                continue
+            username = "user0" if logged_in else None
+            requests = args.login_requests if name == "login" else args.requests
+            results[name] = run_scenario(
+                make_session,
+                request,
+                username,
+                requests,
+                args.concurrency,
+                counter,
+            )
+            print(_format_row(mode, name, results[name]))
+    finally:
+        if server is not None:
+            # Close the sockets from the server's own loop, which returns
+            # once they are gone, rather than from under its select().
+            server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+            server_thread.join()
+            server.task_dispatcher.shutdown()
+    return results
+
+
+def _format_row(mode, name, result):
+    return (
+        f"{mode:<10} {name:<16} {result['throughput']:>9.1f} "
+        f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+        f"{result['p99_ms']:>9.2f} {result['queries_per_request']:>8.2f} "
+        f"{result['errors']:>6}"
+    )
+
+
+def compare(baseline, current, threshold):
+    """List the scenarios that got slower than the baseline allows."""
+    regressions = []
+    for mode, results in current.items():
+        for name, result in results.items():
+            before = baseline.get(mode, {}).get(name)
+            if before is None:
+                continue
+            if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+                regressions.append(
+                    f"{mode}/{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms"
+                )
+            if result["throughput"] < before["throughput"] * (1 - threshold):
+                regressions.append(
+                    f"{mode}/{name}: throughput {before['throughput']}/s"
+                    f" -> {result['throughput']}/s"
+                )
+            if result["queries_per_request"] > before["queries_per_request"]:
+                regressions.append(
+                    f"{mode}/{name}: queries per request"
+                    f" {before['queries_per_request']} -> {result['queries_per_request']}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--login-requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="waitress threads")
+    parser.add_argument(
+        "--mode", choices=("inprocess", "waitress", "both"), default="both"
+    )
+    parser.add_argument("--scenario", action="append", help="only run this scenario")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sonic-bench-")
+    uri = f"sqlite:///{workdir}/bench.sqlite"
+    # Every request comes from one address, which the login limit would stop.
+    app = create_database(
+        uri,
+        args.users,
+        args.posts,
+        {
+            "RATELIMIT_ENABLED": False,
+            "TEMPLATE_CACHE_DIR": os.path.join(workdir, "jinja-cache"),
+        },
+    )
+    app.logger.setLevel("WARNING")
+    logging.getLogger("waitress.queue").setLevel("ERROR")
+    logging.getLogger("sonic.request").setLevel("WARNING")
+    counter = QueryCounter(app)
+
+    own_post = find_own_post(app, "user0")
+
+    with app.app_context():
+        bad_plans = {
+            name: problems
+            for name, (steps, problems) in check_listing_plans().items()
+            if problems
+        }
+    for name, problems in bad_plans.items():
+        print(f"BAD PLAN {name}: {'; '.join(problems)}")
+
+    print(
+        f"{'mode':<10} {'scenario':<16} {'req/s':>9} {'p50 ms':>9} "
+        f"{'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'errors':>6}"
+    )
+    modes = ("inprocess", "waitress") if args.mode == "both" else (args.mode,)
+    results = {mode: run_mode(mode, app, args, counter, own_post) for mode in modes}
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "meta": {
+                        "created": datetime.now(timezone.utc).isoformat(),
+                        "python": platform.python_version(),
+                        "machine": platform.machine(),
+                        "users": args.users,
+                        "posts": args.posts,
+                        "concurrency": args.concurrency,
+                        "threads": args.threads,
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(baseline, results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+    if bad_plans:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
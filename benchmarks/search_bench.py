@@ -0,0 +1,128 @@
+"""Compare FTS5 search against a naive LIKE scan over post bodies.
+
+Builds a throwaway database with the real migrations, loads ``--posts``
+random posts and times both approaches for a few search terms::
+
+    python benchmarks/search_bench.py --posts 100000
+
+The LIKE scan stops at the first page of matches in date order, so it
+is only fast for words found in most posts. FTS5 has to score every
+match with bm25, so very common words cost more there, while rare and
+missing words are answered from the index without reading the posts.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sonic import create_app  # noqa: E402
+from sonic.db import db, init_migrate  # noqa: E402
+from sonic.search import search_posts  # noqa: E402
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), os.pardir, "migrations")
+SPORTS = (
+    "athletics swimming rowing archery fencing judo boxing sailing cycling"
+    " gymnastics diving triathlon marathon sprint relay hurdles javelin discus"
+    " hammer decathlon heptathlon medal podium record final heat qualifier"
+).split()
+# Word frequencies in real text follow Zipf's law: a few words are in
+# almost every post, most words are rare.
+VOCABULARY = [f"w{i}" for i in range(5000)]
+VOCABULARY[10 : 10 + len(SPORTS)] = SPORTS
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+TERMS = ("w0", "athletics", "javelin discus", "w2500", "w4999", "nomatch")
+
+
+def seed(posts, batch=10_000):
+    db.session.execute(
+        text(
+            "INSERT INTO user (username, email, password)"
+            " VALUES ('bench', 'bench@example.com', 'x')"
+        )
+    )
+    rng = random.Random(0)
+    for start in range(0, posts, batch):
+        rows = [
+            {
+                "title": " ".join(rng.choices(VOCABULARY, WEIGHTS, k=6)),
+                "body": " ".join(rng.choices(VOCABULARY, WEIGHTS, k=120)),
+                "created": f"2024-01-01 00:00:{i % 60:02d}",
+            }
+            for i in range(start, min(start + batch, posts))
+        ]
+        db.session.execute(
+            text(
+                "INSERT INTO post (title, body, author_id, created)"
+                " VALUES (:title, :body, 1, :created)"
+            ),
+            rows,
+        )
+    db.session.commit()
+
+
+def like_search(terms, per_page=20):
+    clauses = []
+    params = {"limit": per_page + 1}
+    for i, word in enumerate(terms.split()):
+        clauses.append(f"(title LIKE :w{i} OR body LIKE :w{i})")
+        params[f"w{i}"] = f"%{word}%"
+    return db.session.execute(
+        text(
+            "SELECT p.id, title, body, created, username"
+            " FROM post p JOIN user u ON p.author_id = u.id"
+            f" WHERE {' AND '.join(clauses)}"
+            " ORDER BY created DESC LIMIT :limit"
+        ),
+        params,
+    ).fetchall()
+
+
+def timeit(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sonic-search-bench-")
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{workdir}/bench.sqlite",
+            "TEMPLATE_CACHE_DIR": os.path.join(workdir, "jinja-cache"),
+        }
+    )
+    init_migrate(app)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+        start = time.perf_counter()
+        seed(args.posts)
+        print(f"Loaded {args.posts} posts in {time.perf_counter() - start:.1f}s")
+
+        with app.test_request_context():
+            print(f"{'terms':<20} {'LIKE ms':>10} {'FTS5 ms':>10} {'speedup':>9}")
+            for terms in TERMS:
+                like_ms = timeit(lambda: like_search(terms), args.repeat)
+                fts_ms = timeit(lambda: search_posts(terms), args.repeat)
+                speedup = like_ms / fts_ms if fts_ms else float("inf")
+                print(f"{terms:<20} {like_ms:>10.2f} {fts_ms:>10.2f} {speedup:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
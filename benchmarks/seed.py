@@ -0,0 +1,104 @@
+"""Seed a database with generated users and posts through the models.
+
+Every user gets the password ``PASSWORD``. It is hashed once and the
+hash is reused, so seeding large databases doesn't spend its time in
+the password hasher::
+
+    python benchmarks/seed.py --users 100 --posts 10000 sqlite:////tmp/bench.sqlite
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from flask_migrate import upgrade
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sonic import create_app  # noqa: E402
+from sonic.db import db, init_migrate  # noqa: E402
+from sonic.models import Post, User  # noqa: E402
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), os.pardir, "migrations")
+PASSWORD = "bench-password"
+WORDS = (
+    "athletics swimming rowing archery fencing judo boxing sailing cycling"
+    " gymnastics diving triathlon marathon sprint relay hurdles javelin discus"
+    " hammer decathlon heptathlon medal podium record final heat qualifier"
+    " coach training stadium village torch ceremony anthem team lesson quiz"
+).split()
+
+
+def seed(users, posts, batch=5000, seed=0):
+    """Insert ``users`` users and ``posts`` posts in batches.
+
+    Must be called inside an app context with the schema already created.
+    """
+    rng = random.Random(seed)
+    password = generate_password_hash(PASSWORD)
+
+    for start in range(0, users, batch):
+        db.session.execute(
+            insert(User),
+            [
+                {
+                    "username": f"user{i}",
+                    "email": f"user{i}@example.com",
+                    "password": password,
+                }
+                for i in range(start, min(start + batch, users))
+            ],
+        )
+
+    created = datetime(2024, 1, 1)
+    for start in range(0, posts, batch):
+        db.session.execute(
+            insert(Post),
+            [
+                {
+                    "author_id": rng.randint(1, users),
+                    "created": created + timedelta(minutes=i),
+                    "title": " ".join(rng.choices(WORDS, k=5)).capitalize(),
+                    "body": " ".join(rng.choices(WORDS, k=rng.randint(20, 200))),
+                }
+                for i in range(start, min(start + batch, posts))
+            ],
+        )
+        db.session.commit()
+    db.session.commit()
+
+
+def create_database(uri, users, posts, config=None):
+    """Create a database at ``uri`` with the migrations and seed it.
+
+    :param config: extra config for the returned app, compiled templates
+        go to a temporary ``TEMPLATE_CACHE_DIR`` unless it is given
+    """
+    config = {"SQLALCHEMY_DATABASE_URI": uri, **(config or {})}
+    # Keep the instance folder of the checkout clean
+    config.setdefault("TEMPLATE_CACHE_DIR", tempfile.mkdtemp(prefix="sonic-jinja-"))
+    app = create_app(config)
+    init_migrate(app)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+        seed(users, posts)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("uri", help="database URI to create")
+    args = parser.parse_args()
+    create_database(args.uri, args.users, args.posts)
+    print(f"Seeded {args.users} users and {args.posts} posts into {args.uri}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Measure the cold start time of the app, up to its first response.
+
+Every run starts a fresh interpreter that imports the app, calls
+``create_app`` and serves ``/`` through the test client::
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --eager   # with STARTUP_LAZY off
+    python benchmarks/startup.py --importtime
+
+``--importtime`` also lists the modules that took the longest to import,
+from ``python -X importtime``.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from sonic import create_app
+imported = time.perf_counter()
+app = create_app(json.loads(sys.argv[1]))
+created = time.perf_counter()
+status = app.test_client().get("/").status_code
+done = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (done - created) * 1000,
+    "total_ms": (done - started) * 1000,
+    "status": status,
+}))
+"""
+
+
+def run_once(config, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", CHILD, json.dumps(config)]
+    result = subprocess.run(
+        command, cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, count, depth=2):
+    """Get the imports with the largest cumulative time.
+
+    Only modules imported up to ``depth`` levels deep are listed, so the
+    app's own modules and their direct dependencies show up.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Names are indented by two spaces per level after one separator.
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level <= depth and cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--eager", action="store_true", help="turn STARTUP_LAZY off")
+    parser.add_argument("--importtime", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sonic-startup-")
+    config = {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{workdir}/startup.sqlite",
+        "TEMPLATE_CACHE_DIR": os.path.join(workdir, "jinja-cache"),
+        "STARTUP_LAZY": not args.eager,
+    }
+    # The posts table must exist for the index page.
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(ROOT, "benchmarks", "seed.py"),
+            "--users",
+            "1",
+            "--posts",
+            "20",
+            config["SQLALCHEMY_DATABASE_URI"],
+        ],
+        cwd=ROOT,
+        capture_output=True,
+        check=True,
+    )
+
+    runs = [run_once(config)[0] for _ in range(args.runs)]
+    print(f"{'phase':<18} {'median ms':>10} {'min ms':>10}")
+    for phase in ("import_ms", "create_app_ms", "first_request_ms", "total_ms"):
+        values = [run[phase] for run in runs]
+        print(f"{phase:<18} {statistics.median(values):>10.1f} {min(values):>10.1f}")
+
+    if args.importtime:
+        _, stderr = run_once(config, importtime=True)
+        print(f"\n{'module':<40} {'cumulative ms':>14}")
+        for cumulative, name in slowest_imports(stderr, 15):
+            print(f"{name:<40} {cumulative / 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
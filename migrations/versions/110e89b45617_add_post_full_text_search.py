@@ -0,0 +1,55 @@
+"""add post full text search
+
+Revision ID: 110e89b45617
+Revises: 7232ad0a1819
+Create Date: 2026-10-18 10:02:17.540913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '110e89b45617'
+down_revision = '7232ad0a1819'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # External content table: the index stores only the tokens and reads
+    # the text back from post, kept in sync by the triggers below.
+    op.execute(
+        "CREATE VIRTUAL TABLE post_fts USING fts5("
+        "title, body, content='post', content_rowid='id',"
+        " tokenize='unicode61 remove_diacritics 2')"
+    )
+    op.execute(
+        "CREATE TRIGGER post_fts_ai AFTER INSERT ON post BEGIN"
+        " INSERT INTO post_fts(rowid, title, body)"
+        " VALUES (new.id, new.title, new.body);"
+        " END"
+    )
+    op.execute(
+        "CREATE TRIGGER post_fts_ad AFTER DELETE ON post BEGIN"
+        " INSERT INTO post_fts(post_fts, rowid, title, body)"
+        " VALUES ('delete', old.id, old.title, old.body);"
+        " END"
+    )
+    op.execute(
+        "CREATE TRIGGER post_fts_au AFTER UPDATE OF title, body ON post BEGIN"
+        " INSERT INTO post_fts(post_fts, rowid, title, body)"
+        " VALUES ('delete', old.id, old.title, old.body);"
+        " INSERT INTO post_fts(rowid, title, body)"
+        " VALUES (new.id, new.title, new.body);"
+        " END"
+    )
+    # Index the posts that already exist
+    op.execute("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS post_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS post_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS post_fts_ai")
+    op.execute("DROP TABLE IF EXISTS post_fts")
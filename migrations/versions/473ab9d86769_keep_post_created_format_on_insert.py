@@ -0,0 +1,53 @@
+"""keep post created format on insert
+
+Revision ID: 473ab9d86769
+Revises: acc3f377727b
+Create Date: 2026-10-18 17:12:30.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '473ab9d86769'
+down_revision = 'acc3f377727b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The server default, CURRENT_TIMESTAMP, and raw SQL store
+    # "YYYY-MM-DD HH:MM:SS" without microseconds. Rewrite those rows to the
+    # format bound by the page cursors, or a page would match its own
+    # cursor row again.
+    op.execute(
+        "CREATE TRIGGER post_created_ai AFTER INSERT ON post"
+        " WHEN length(new.created) = 19 OR new.created LIKE '____-__-__T%' BEGIN"
+        " UPDATE post SET created = replace(new.created, 'T', ' ')"
+        " || CASE WHEN length(new.created) = 19 THEN '.000000' ELSE '' END"
+        " WHERE id = new.id;"
+        " END"
+    )
+    op.execute(
+        "CREATE TRIGGER post_created_au AFTER UPDATE OF created ON post"
+        " WHEN length(new.created) = 19 OR new.created LIKE '____-__-__T%' BEGIN"
+        " UPDATE post SET created = replace(new.created, 'T', ' ')"
+        " || CASE WHEN length(new.created) = 19 THEN '.000000' ELSE '' END"
+        " WHERE id = new.id;"
+        " END"
+    )
+    # Rows inserted since the previous migration
+    op.execute(
+        "UPDATE post SET created = replace(created, 'T', ' ')"
+        " WHERE created LIKE '____-__-__T%'"
+    )
+    op.execute(
+        "UPDATE post SET created = created || '.000000'"
+        " WHERE length(created) = 19"
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER post_created_au")
+    op.execute("DROP TRIGGER post_created_ai")
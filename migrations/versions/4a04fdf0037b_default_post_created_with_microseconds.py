@@ -0,0 +1,72 @@
+"""default post created with microseconds
+
+Revision ID: 4a04fdf0037b
+Revises: 473ab9d86769
+Create Date: 2026-10-18 13:41:08.226431
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a04fdf0037b'
+down_revision = '473ab9d86769'
+branch_labels = None
+depends_on = None
+
+OLD_DEFAULT = "created DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL"
+NEW_DEFAULT = (
+    "created DATETIME DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')) NOT NULL"
+)
+
+
+def _replace_in_post_schema(old, new):
+    # SQLite can't ALTER a column default, and a batch copy of post would
+    # drop its triggers. A default doesn't change what is stored, so the
+    # schema text is edited as described in https://sqlite.org/lang_altertable.html
+    conn = op.get_bind()
+    sql = conn.execute(
+        sa.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'post'")
+    ).scalar()
+    if old not in sql:
+        raise RuntimeError(f"Unexpected post table schema: {sql}")
+    version = conn.execute(sa.text("PRAGMA schema_version")).scalar()
+    conn.exec_driver_sql("PRAGMA writable_schema = ON")
+    conn.execute(
+        sa.text(
+            "UPDATE sqlite_master SET sql = :sql"
+            " WHERE type = 'table' AND name = 'post'"
+        ),
+        {"sql": sql.replace(old, new)},
+    )
+    conn.exec_driver_sql(f"PRAGMA schema_version = {version + 1}")
+    conn.exec_driver_sql("PRAGMA writable_schema = OFF")
+
+
+def upgrade():
+    # Store the default in the format bound by the page cursors, instead of
+    # rewriting every inserted row with the triggers.
+    op.execute("DROP TRIGGER post_created_au")
+    op.execute("DROP TRIGGER post_created_ai")
+    _replace_in_post_schema(OLD_DEFAULT, NEW_DEFAULT)
+
+
+def downgrade():
+    _replace_in_post_schema(NEW_DEFAULT, OLD_DEFAULT)
+    op.execute(
+        "CREATE TRIGGER post_created_ai AFTER INSERT ON post"
+        " WHEN length(new.created) = 19 OR new.created LIKE '____-__-__T%' BEGIN"
+        " UPDATE post SET created = replace(new.created, 'T', ' ')"
+        " || CASE WHEN length(new.created) = 19 THEN '.000000' ELSE '' END"
+        " WHERE id = new.id;"
+        " END"
+    )
+    op.execute(
+        "CREATE TRIGGER post_created_au AFTER UPDATE OF created ON post"
+        " WHEN length(new.created) = 19 OR new.created LIKE '____-__-__T%' BEGIN"
+        " UPDATE post SET created = replace(new.created, 'T', ' ')"
+        " || CASE WHEN length(new.created) = 19 THEN '.000000' ELSE '' END"
+        " WHERE id = new.id;"
+        " END"
+    )
@@ -0,0 +1,35 @@
+"""store post created in the DateTime format
+
+Revision ID: 502e8f9e40c8
+Revises: a029f060409c
+Create Date: 2026-10-18 13:02:41.507316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '502e8f9e40c8'
+down_revision = 'a029f060409c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Posts written through raw SQL were stored as "YYYY-MM-DD HH:MM:SS"
+    # (or with a "T"), posts written through the model with microseconds.
+    # Keyset pages compare the text, so every row needs the same format.
+    op.execute(
+        "UPDATE post SET created = replace(created, 'T', ' ')"
+        " WHERE created LIKE '____-__-__T%'"
+    )
+    op.execute(
+        "UPDATE post SET created = created || '.000000'"
+        " WHERE length(created) = 19"
+    )
+
+
+def downgrade():
+    # The microseconds format is read fine by older code.
+    pass
@@ -0,0 +1,60 @@
+"""denormalize post author username
+
+Revision ID: a029f060409c
+Revises: 9e597a0be430
+Create Date: 2026-10-18 12:31:05.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a029f060409c'
+down_revision = '9e597a0be430'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain ALTER TABLE, a batch copy of post would drop its triggers.
+    op.add_column(
+        'post',
+        sa.Column('author_username', sa.String(), server_default='', nullable=False),
+    )
+    op.execute(
+        "UPDATE post SET author_username ="
+        " (SELECT username FROM user WHERE user.id = post.author_id)"
+    )
+    op.create_index(
+        'ix_post_author_id_created', 'post', ['author_id', 'created', 'id'], unique=False
+    )
+
+    # Keep author_username in sync however posts and users are written.
+    op.execute(
+        "CREATE TRIGGER post_author_ai AFTER INSERT ON post"
+        " WHEN new.author_username IS NOT"
+        " (SELECT username FROM user WHERE id = new.author_id) BEGIN"
+        " UPDATE post SET author_username ="
+        " (SELECT username FROM user WHERE id = new.author_id) WHERE id = new.id;"
+        " END"
+    )
+    op.execute(
+        "CREATE TRIGGER post_author_au AFTER UPDATE OF author_id ON post BEGIN"
+        " UPDATE post SET author_username ="
+        " (SELECT username FROM user WHERE id = new.author_id) WHERE id = new.id;"
+        " END"
+    )
+    op.execute(
+        "CREATE TRIGGER user_username_au AFTER UPDATE OF username ON user BEGIN"
+        " UPDATE post SET author_username = new.username WHERE author_id = new.id;"
+        " END"
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER user_username_au")
+    op.execute("DROP TRIGGER post_author_au")
+    op.execute("DROP TRIGGER post_author_ai")
+    op.drop_index('ix_post_author_id_created', table_name='post')
+    op.drop_column('post', 'author_username')
@@ -1,14 +1,34 @@
 import os
-import time
 import logging
+import time
 
-from flask import Flask, request, g
-from sonic.db import db, init_app, init_db
-from sonic.models import *
+# Measured before the other imports for the STARTUP_PROFILE report
+_IMPORT_STARTED = time.perf_counter()
+
+import click
+from flask import Flask
+from flask.cli import ScriptInfo
+from sonic import (
+    aio,
+    assets,
+    cache,
+    compress,
+    hashing,
+    metrics,
+    ratelimit,
+    requestlog,
+    sessions,
+    tasks,
+    templating,
+)
+from sonic.db import db, init_app, init_db, init_migrate
+
+_IMPORT_FINISHED = time.perf_counter()
 
 
 def create_app(test_config=None):
     """Create and configure an instance of the Flask application."""
+    started = time.perf_counter()
     app = Flask(__name__, instance_relative_config=True)
 
     # Database configuration
@@ -23,6 +43,106 @@ def create_app(test_config=None):
         SECRET_KEY="dev",
         SQLALCHEMY_DATABASE_URI=database_uri,
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # WAL lets readers keep reading while a writer commits.
+        SQLITE_PRAGMAS={
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "mmap_size": 268435456,
+            "cache_size": -16000,
+            "temp_store": "MEMORY",
+        },
+        DB_POOL_SIZE=8,
+        DB_POOL_MAX_OVERFLOW=8,
+        DB_POOL_TIMEOUT=10,
+        DB_POOL_RECYCLE=-1,
+        DB_POOL_PRE_PING=False,
+        SQLALCHEMY_READ_URI=None,
+        DB_READ_STICKY_SECONDS=5,
+        SLOW_QUERY_SECONDS=0.1,
+        QUERY_TRACKER_HEADERS=None,
+        QUERY_BUDGET_STRICT=None,
+        SEARCH_PER_PAGE=20,
+        API_TOKEN_MAX_AGE=86400,
+        API_BULK_MAX=500,
+        TASK_MODE="thread",
+        TASK_WORKERS=2,
+        TASK_POLL_INTERVAL=5,
+        TASK_MAX_ATTEMPTS=5,
+        TASK_RETRY_DELAY=10,
+        TASK_TIMEOUT=300,
+        NOTIFY_WEBHOOK_URL=None,
+        NOTIFY_TIMEOUT=5,
+        PASSWORD_HASH_METHOD="scrypt",
+        PASSWORD_HASH_WORKERS=2,
+        PASSWORD_HASH_MAX_PENDING=8,
+        PASSWORD_HASH_RETRY_AFTER=1,
+        POSTS_PER_PAGE=20,
+        POSTS_PER_PAGE_MAX=100,
+        POSTS_STREAM=False,
+        POSTS_STREAM_YIELD_PER=100,
+        POSTS_PREVIEW_CHARS=None,
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=300,
+        USER_CACHE_STORE=None,
+        PAGE_CACHE_SIZE=256,
+        PAGE_CACHE_TTL=300,
+        FRAGMENT_CACHE_SIZE=4096,
+        FRAGMENT_CACHE_TTL=3600,
+        REQUEST_LOG_QUEUE_SIZE=10000,
+        REQUEST_LOG_SAMPLE_RATE=1.0,
+        REQUEST_LOG_SAMPLE_RATES={"static": 0.0},
+        REQUEST_LOG_HEADERS=("User-Agent", "Referer", "Content-Type", "Content-Length"),
+        REQUEST_LOG_BODY_MAX=0,
+        REQUEST_LOG_BODY_TYPES=("application/json",),
+        # Token bucket limits are (requests, seconds), see sonic.ratelimit
+        RATELIMIT_ENABLED=True,
+        RATELIMIT_STORE=None,
+        RATELIMIT_PROXY_HOPS=0,
+        RATELIMIT_PER_IP=None,
+        RATELIMIT_PER_USER=None,
+        RATELIMIT_ROUTES={
+            "POST auth.login": (10, 60),
+            "POST auth.register": (5, 60),
+            "POST api.create_token": (10, 60),
+        },
+        RATELIMIT_EXEMPT=("static", "metrics", "version"),
+        RATELIMIT_MAX_IN_FLIGHT=None,
+        RATELIMIT_RETRY_AFTER=1,
+        # gzip, and brotli with the brotli package, see sonic.compress
+        COMPRESS_ENABLED=True,
+        COMPRESS_MIN_SIZE=500,
+        COMPRESS_MIMETYPES=(
+            "text/html",
+            "text/css",
+            "text/plain",
+            "text/csv",
+            "application/json",
+            "application/javascript",
+            "text/javascript",
+            "image/svg+xml",
+        ),
+        COMPRESS_GZIP_LEVEL=6,
+        COMPRESS_BR_LEVEL=4,
+        # For static URLs with the current fingerprint, see sonic.assets
+        STATIC_MAX_AGE=31536000,
+        # "cookie" or "sqlite", see sonic.sessions
+        SESSION_BACKEND="cookie",
+        SESSION_CACHE_SIZE=4096,
+        SESSION_CACHE_TTL=300,
+        SESSION_SWEEP_INTERVAL=3600,
+        METRICS_ENABLED=True,
+        METRICS_BUCKETS=metrics.LATENCY_BUCKETS,
+        # Only load migrations and CLI commands when run by the flask command
+        STARTUP_LAZY=True,
+        STARTUP_PROFILE=False,
+        # Serve / and /auth/login with async views, see sonic.aio
+        ASYNC_VIEWS=False,
+        ASGI_THREADS=8,
+        TEMPLATE_CACHE_DIR=os.path.join(app.instance_path, "jinja-cache"),
+        TEMPLATE_PRELOAD=True,
+        # None reloads changed templates only in debug mode
+        TEMPLATES_AUTO_RELOAD=None,
     )
 
     if test_config is None:
@@ -30,6 +150,12 @@ def create_app(test_config=None):
     else:
         app.config.update(test_config)
 
+    # Enforce the query budgets when testing, only log them in production
+    if app.config["QUERY_BUDGET_STRICT"] is None:
+        app.config["QUERY_BUDGET_STRICT"] = app.testing
+    if app.config["QUERY_TRACKER_HEADERS"] is None:
+        app.config["QUERY_TRACKER_HEADERS"] = app.debug
+
     # ensure the instance folder exists
     try:
         os.makedirs(app.instance_path)
@@ -40,71 +166,63 @@ def create_app(test_config=None):
     @app.route("/version")
     def version():
         app_version = os.getenv("APP_VERSION", "0")
-        print("Version requested.")
         return {"version": app_version}
 
-    # register the database and migrations
+    # register the database
     init_app(app)
-
-    # Initialize the database only if it does not exist
-    with app.app_context():
-        init_db()
+    cache.init_app(app)
+    sessions.init_app(app)
+    hashing.init_app(app)
+    tasks.init_app(app)
+    templating.init_app(app)
+
+    # Alembic and the maintenance commands are only needed by the flask
+    # command, servers skip importing them. Other click programs, such as
+    # uvicorn, have a context but no ScriptInfo.
+    context = click.get_current_context(silent=True)
+    if not app.config["STARTUP_LAZY"] or (
+        context is not None and context.find_object(ScriptInfo) is not None
+    ):
+        from sonic import cli
+
+        init_migrate(app)
+        cli.init_app(app)
+
+        # Initialize the database only if it does not exist
+        with app.app_context():
+            init_db()
 
     # Register blueprints and other components
-    from sonic import auth, blog
+    from sonic import api, auth, blog, search
+    app.register_blueprint(api.bp)
     app.register_blueprint(auth.bp)
     app.register_blueprint(blog.bp)
+    app.register_blueprint(search.bp)
     app.add_url_rule("/", endpoint="index")
-
-    configure_logging(app)
+    if app.config["ASYNC_VIEWS"]:
+        aio.init_app(app)
+
+    requestlog.init_app(app)
+    metrics.init_app(app)
+    ratelimit.init_app(app)
+    assets.init_app(app)
+    compress.init_app(app)
+
+    # Compile the templates now rather than during the first requests
+    if app.config["TEMPLATE_PRELOAD"]:
+        templating.preload_templates(app)
+
+    if app.config["STARTUP_PROFILE"]:
+        imports = (_IMPORT_FINISHED - _IMPORT_STARTED) * 1000
+        created = (time.perf_counter() - started) * 1000
+        app.logger.info(
+            f"Startup took {imports + created:.0f} ms: imports {imports:.0f} ms,"
+            f" create_app {created:.0f} ms. Run with python -X importtime for"
+            " a per-module profile."
+        )
 
     return app
 
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
-
-
-def configure_logging(app):
-    @app.before_request
-    def start_timer():
-        g.start = time.time()
-
-    @app.after_request
-    def log_request(response):
-        if request.path == "/favicon.ico":
-            return response
-        if request.path.startswith("/static"):
-            return response
-
-        now = time.time()
-        duration = round(now - g.start, 2)
-        ip = request.headers.get("X-Forwarded-For", request.remote_addr)
-        host = request.host.split(":", 1)[0]
-        params = dict(request.args)
-        headers = dict(request.headers)
-
-        # Limit body logging for performance and security
-        try:
-            body = request.get_data(as_text=True)
-        except Exception as e:
-            body = f"Error reading body: {e}"
-
-        log_params = [
-            ("method", request.method),
-            ("path", request.path),
-            ("status", response.status_code),
-            ("duration", duration),
-            ("ip", ip),
-            ("host", host),
-            ("params", params),
-            ("headers", headers),
-            ("body", body),
-        ]
-
-        parts = [f"{name}={value}" for name, value in log_params]
-        line = " ".join(parts)
-
-        app.logger.info(line)
-
-        return response
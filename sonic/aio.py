@@ -0,0 +1,64 @@
+from flask import current_app
+from sqlalchemy.engine import make_url
+
+from sonic.db import instrument_engine
+
+# Every async query opens a new connection. journal_mode = WAL is stored
+# in the database file by the sync engine, and the memory map and page
+# cache aren't worth setting up for a single query.
+_CONNECTION_PRAGMAS = ("busy_timeout", "synchronous")
+
+
+def _create_engine(app):
+    """Create the async engine for ``SQLALCHEMY_DATABASE_URI``.
+
+    SQLite URIs are switched to the aiosqlite driver. Connections aren't
+    pooled: an aiosqlite connection belongs to the event loop that
+    opened it, and under a WSGI server every async view runs in a new
+    event loop. Only the ``SQLITE_PRAGMAS`` that matter for each query
+    are run on its connection.
+    """
+    # Imported here so the sync mode doesn't need greenlet or aiosqlite.
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.drivername == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    engine = create_async_engine(url, poolclass=NullPool)
+    pragmas = {
+        name: value
+        for name, value in app.config["SQLITE_PRAGMAS"].items()
+        if name in _CONNECTION_PRAGMAS
+    }
+    instrument_engine(app, engine.sync_engine, pragmas)
+    return engine
+
+
+def get_async_engine():
+    """Get the async engine of the current app."""
+    return current_app.extensions["sonic_async_engine"]
+
+
+async def execute(query, params=None):
+    """Run a query on the async engine.
+
+    :return: the result, with its rows already fetched, so it can be
+        read after the connection is closed
+    """
+    async with get_async_engine().connect() as conn:
+        return await conn.execute(query, params or {})
+
+
+def init_app(app):
+    """Serve the index and login pages with their async views.
+
+    Called by ``create_app`` when ``ASYNC_VIEWS`` is set. Needs the
+    ``async`` extra: Flask's async support, SQLAlchemy's asyncio
+    extension and aiosqlite.
+    """
+    from sonic import auth, blog
+
+    app.extensions["sonic_async_engine"] = _create_engine(app)
+    app.view_functions["blog.index"] = blog.index_async
+    app.view_functions["auth.login"] = auth.login_async
@@ -0,0 +1,306 @@
+from collections import defaultdict, deque
+from datetime import datetime
+
+from flask import Blueprint, g, jsonify, request, current_app as app
+from sqlalchemy import bindparam, insert, text
+from werkzeug.datastructures import WWWAuthenticate
+from werkzeug.exceptions import HTTPException, abort
+
+from sonic.auth import generate_token, login_required
+from sonic.blog import (
+    POST_COLUMNS,
+    get_posts_page,
+    invalidate_feed,
+    select_posts,
+    typed_post_query,
+)
+from sonic.db import get_db, get_read_db, query_budget
+from sonic.hashing import get_hasher
+from sonic.models import Post
+from sonic.tasks import notify_later
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+@bp.errorhandler(HTTPException)
+def handle_http_error(error):
+    """Answer API errors with JSON instead of an HTML page."""
+    response = jsonify(error=error.name, message=error.description)
+    response.status_code = error.code
+    if error.code == 401:
+        response.www_authenticate = WWWAuthenticate("bearer")
+    return response
+
+
+def _json_body():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, "Expected a JSON object.")
+    return data
+
+
+def _parse_fields():
+    """Get the columns requested with ``fields=title,created,...``."""
+    fields = request.args.get("fields")
+    if not fields:
+        return None
+    fields = fields.split(",")
+    unknown = set(fields) - POST_COLUMNS.keys()
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+    return fields
+
+
+def _parse_ids(ids):
+    """Validate a list of post ids against ``API_BULK_MAX``."""
+    if not isinstance(ids, list) or not ids:
+        abort(400, "Expected a non-empty list of ids.")
+    if len(ids) > app.config["API_BULK_MAX"]:
+        abort(400, f"At most {app.config['API_BULK_MAX']} ids are allowed.")
+    if not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+        abort(400, "Ids must be integers.")
+    return ids
+
+
+def _bulk_items(data, key):
+    """Get the list of objects under ``key`` in a bulk request body."""
+    items = data.get(key)
+    if not isinstance(items, list) or not items:
+        abort(400, f"Expected a non-empty list of {key}.")
+    if len(items) > app.config["API_BULK_MAX"]:
+        abort(400, f"At most {app.config['API_BULK_MAX']} {key} are allowed.")
+    if not all(isinstance(item, dict) for item in items):
+        abort(400, f"Each of the {key} must be an object.")
+    return items
+
+
+def _check_body(item):
+    """Check that the optional ``body`` of an item is a string."""
+    if item.get("body") is not None and not isinstance(item["body"], str):
+        abort(400, "Body must be a string.")
+
+
+def serialize_post(post):
+    """Convert a post row to JSON-safe values."""
+    post = post._asdict()
+    post["created"] = post["created"].isoformat()
+    return post
+
+
+def get_posts_by_ids(ids, fields=None):
+    """Get many posts in one query, in the order of ``ids``.
+
+    Ids that don't exist are left out.
+    """
+    query = typed_post_query(select_posts(fields) + " WHERE p.id IN :ids").bindparams(
+        bindparam("ids", expanding=True)
+    )
+    rows = get_read_db().execute(query, {"ids": ids})
+    posts = {row.id: row for row in rows}
+    return [posts[id] for id in ids if id in posts]
+
+
+def _check_owned(ids):
+    """Check in one query that the current user wrote all the posts.
+
+    :raise 404: if any of the posts doesn't exist
+    :raise 403: if any of the posts belongs to someone else
+    """
+    query = text("SELECT id, author_id FROM post WHERE id IN :ids").bindparams(
+        bindparam("ids", expanding=True)
+    )
+    authors = dict(get_db().execute(query, {"ids": ids}).fetchall())
+    missing = [id for id in ids if id not in authors]
+    if missing:
+        abort(404, f"Posts {missing} don't exist.")
+    if any(author_id != g.user["id"] for author_id in authors.values()):
+        app.logger.warning(f"User {g.user['id']} tried to change posts they don't own.")
+        abort(403)
+
+
+@bp.route("/tokens", methods=("POST",))
+@query_budget(2)
+def create_token():
+    """Exchange a username and password for an API token."""
+    data = _json_body()
+    username = data.get("username")
+    password = data.get("password")
+    if not isinstance(username, str) or not isinstance(password, str):
+        abort(400, "Username and password must be strings.")
+    user = (
+        get_db()
+        .execute(
+            text("SELECT id, password FROM user WHERE username = :username"),
+            {"username": username},
+        )
+        .mappings()
+        .fetchone()
+    )
+    if user is None or not get_hasher().verify(user["password"], password):
+        app.logger.warning(f"API token refused for {username}.")
+        abort(401, "Incorrect username or password.")
+
+    app.logger.info(f"Issued an API token to user {user['id']}.")
+    return {
+        "token": generate_token(user["id"]),
+        "expires_in": app.config["API_TOKEN_MAX_AGE"],
+    }
+
+
+@bp.route("/posts", methods=("GET",))
+@query_budget(2)
+def list_posts():
+    """List posts newest first, or get many posts with ``ids=1,2,3``.
+
+    Pages are navigated with the ``after`` and ``before`` cursors from
+    the previous response, and ``fields`` selects the columns returned,
+    for example ``fields=title,created`` to skip the post bodies.
+    """
+    fields = _parse_fields()
+
+    ids = request.args.get("ids")
+    if ids is not None:
+        try:
+            ids = [int(id) for id in ids.split(",")]
+        except ValueError:
+            abort(400, "Ids must be integers.")
+        posts = get_posts_by_ids(_parse_ids(ids), fields)
+        return {"posts": [serialize_post(post) for post in posts]}
+
+    limit = min(
+        request.args.get("limit", app.config["POSTS_PER_PAGE"], type=int),
+        app.config["POSTS_PER_PAGE_MAX"],
+    )
+    if limit < 1:
+        abort(400, "Invalid page size.")
+    page = get_posts_page(
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        limit=limit,
+        fields=fields,
+    )
+    return {
+        "posts": [serialize_post(post) for post in page.posts],
+        "prev": page.prev_cursor,
+        "next": page.next_cursor,
+    }
+
+
+@bp.route("/posts/<int:id>", methods=("GET",))
+@query_budget(2)
+def get_post(id):
+    """Get a single post."""
+    posts = get_posts_by_ids([id], _parse_fields())
+    if not posts:
+        abort(404, f"Post id {id} doesn't exist.")
+    return serialize_post(posts[0])
+
+
+@bp.route("/posts", methods=("POST",))
+@login_required
+@query_budget(3)
+def create_posts():
+    """Create many posts for the current user in one transaction.
+
+    Expects ``{"posts": [{"title": ..., "body": ...}, ...]}`` and returns
+    the ids of the new posts in the same order.
+    """
+    items = _bulk_items(_json_body(), "posts")
+    created = datetime.now().replace(microsecond=0)
+    rows = []
+    for item in items:
+        if not item.get("title") or not isinstance(item["title"], str):
+            abort(400, "Title is required.")
+        _check_body(item)
+        rows.append(
+            {
+                "title": item["title"],
+                "body": item.get("body") or "",
+                "author_id": g.user["id"],
+                "author_username": g.user["username"],
+                "created": created,
+            }
+        )
+
+    # One multi-row INSERT for the whole batch. SQLite doesn't promise the
+    # order of RETURNING rows, and sort_by_parameter_order would make
+    # SQLAlchemy run one INSERT per row on SQLite. Match the returned rows
+    # to the items by their content instead; identical items are
+    # interchangeable.
+    returned = get_db().execute(
+        insert(Post).returning(Post.id, Post.title, Post.body), rows
+    )
+    ids_by_content = defaultdict(deque)
+    for id, title, body in sorted(returned):
+        ids_by_content[title, body].append(id)
+    ids = [ids_by_content[row["title"], row["body"]].popleft() for row in rows]
+    notify_later(f"{g.user['username']} posted {len(ids)} posts.")
+    get_db().commit()
+    invalidate_feed()
+    app.logger.info(f"User {g.user['id']} created {len(ids)} posts through the API.")
+    return {"ids": ids}, 201
+
+
+@bp.route("/posts", methods=("PATCH",))
+@login_required
+@query_budget(3)
+def update_posts():
+    """Update many posts of the current user in one transaction.
+
+    Expects ``{"posts": [{"id": ..., "title": ..., "body": ...}, ...]}``.
+    Fields left out of an item are not changed.
+    """
+    items = _bulk_items(_json_body(), "posts")
+    rows = []
+    for item in items:
+        if "title" in item and (
+            not item["title"] or not isinstance(item["title"], str)
+        ):
+            abort(400, "Title is required.")
+        _check_body(item)
+        rows.append(
+            {
+                "id": item.get("id"),
+                "title": item.get("title"),
+                "body": item.get("body"),
+            }
+        )
+    ids = _parse_ids([row["id"] for row in rows])
+    _check_owned(ids)
+
+    get_db().execute(
+        text(
+            "UPDATE post SET title = coalesce(:title, title),"
+            " body = coalesce(:body, body) WHERE id = :id"
+        ),
+        rows,
+    )
+    get_db().commit()
+    for id in ids:
+        invalidate_feed(id)
+    app.logger.info(f"User {g.user['id']} updated {len(ids)} posts through the API.")
+    return {"ids": ids}
+
+
+@bp.route("/posts", methods=("DELETE",))
+@login_required
+@query_budget(3)
+def delete_posts():
+    """Delete many posts of the current user in one transaction.
+
+    Expects ``{"ids": [...]}``.
+    """
+    ids = _parse_ids(_json_body().get("ids"))
+    _check_owned(ids)
+
+    get_db().execute(
+        text("DELETE FROM post WHERE id IN :ids").bindparams(
+            bindparam("ids", expanding=True)
+        ),
+        {"ids": ids},
+    )
+    get_db().commit()
+    for id in ids:
+        invalidate_feed(id)
+    app.logger.info(f"User {g.user['id']} deleted {len(ids)} posts through the API.")
+    return {"ids": ids}
@@ -0,0 +1,58 @@
+"""Serve the app with an ASGI server::
+
+    uvicorn --factory sonic.asgi:create_asgi_app
+
+Set ``ASYNC_VIEWS = True`` in the instance config to also serve the
+index and login pages with their async views.
+
+Flask is a WSGI app, so every request still runs in a thread, at most
+``ASGI_THREADS`` at once. The server's event loop holds the idle and
+slow connections, and the async views run their queries on that loop.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from sonic import create_app
+
+
+class _PooledInstance(WsgiToAsgiInstance):
+    def __init__(self, executor, *args):
+        super().__init__(*args)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        # asgiref runs every request on one shared thread by default.
+        run = WsgiToAsgiInstance.run_wsgi_app.__wrapped__
+        await sync_to_async(run, thread_sensitive=False, executor=self.executor)(
+            self, body
+        )
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    """Run a WSGI app under ASGI in a pool of ``threads`` threads."""
+
+    def __init__(self, wsgi_application, threads):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="sonic-asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            # Nothing to start or stop, but servers expect an answer.
+            await receive()
+            await send({"type": "lifespan.startup.complete"})
+            await receive()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        instance = _PooledInstance(
+            self.executor, self.wsgi_application, self.duplicate_header_limit
+        )
+        await instance(scope, receive, send)
+
+
+def create_asgi_app(test_config=None):
+    """Create the app wrapped for an ASGI server, see :func:`create_app`."""
+    app = create_app(test_config)
+    return PooledWsgiToAsgi(app, app.config["ASGI_THREADS"])
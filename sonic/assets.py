@@ -0,0 +1,133 @@
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+from sonic.compress import EXTENSIONS, compress, encodings
+
+
+def _fingerprint(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+class StaticAssets:
+    """Serve the static files with fingerprinted URLs and precompressed.
+
+    ``url_for("static", filename=...)`` adds a ``v`` argument with a hash
+    of the file. Requests with the current hash may be cached for
+    ``STATIC_MAX_AGE`` seconds without revalidating, as the URL changes
+    with the file.
+
+    ``.br`` and ``.gz`` files made by :func:`compress_static` next to a
+    static file are sent instead to clients that accept them.
+    """
+
+    def __init__(self, app):
+        self.folder = app.static_folder
+        self.max_age = app.config["STATIC_MAX_AGE"]
+        # Notice changed files while developing
+        self.reload = app.debug
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, filename):
+        """Get the fingerprint and precompressed encodings of a static file.
+
+        :return: tuple of ``(fingerprint, encodings)``, ``None`` if the
+            file doesn't exist
+        """
+        entry = self._files.get(filename)
+        if entry is not None and not self.reload:
+            return entry[1]
+        path = safe_join(self.folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        mtime = os.stat(path).st_mtime_ns
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        available = tuple(
+            encoding
+            for encoding in encodings()
+            if os.path.isfile(path + EXTENSIONS[encoding])
+            and os.stat(path + EXTENSIONS[encoding]).st_mtime_ns >= mtime
+        )
+        info = (_fingerprint(path), available)
+        with self._lock:
+            self._files[filename] = (mtime, info)
+        return info
+
+    def url_defaults(self, endpoint, values):
+        if endpoint == "static" and "v" not in values:
+            info = self.lookup(values["filename"])
+            if info is not None:
+                values["v"] = info[0]
+
+    def send(self, filename):
+        """The ``static`` view."""
+        info = self.lookup(filename)
+        if info is None:
+            # A 404, or a 400 for paths outside the folder
+            return send_from_directory(self.folder, filename)
+        fingerprint, available = info
+
+        fingerprinted = request.args.get("v") == fingerprint
+        encoding = request.accept_encodings.best_match(available)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response = send_from_directory(
+            self.folder,
+            filename + EXTENSIONS[encoding] if encoding else filename,
+            mimetype=mimetype,
+            max_age=self.max_age if fingerprinted else None,
+        )
+        if encoding:
+            response.content_encoding = encoding
+        if available:
+            response.vary.add("Accept-Encoding")
+        if fingerprinted:
+            response.cache_control.immutable = True
+        return response
+
+
+def compress_static(app):
+    """Write ``.br`` and ``.gz`` copies of the compressible static files.
+
+    Uses the strongest levels, as this runs once when building a
+    deployment. Files smaller than ``COMPRESS_MIN_SIZE`` and copies that
+    aren't smaller than the file are skipped.
+
+    :return: the paths of the files written
+    """
+    compressible = set(app.config["COMPRESS_MIMETYPES"])
+    levels = {"br": 11, "gzip": 9}
+    written = []
+    for root, _, files in os.walk(app.static_folder):
+        for name in sorted(files):
+            if os.path.splitext(name)[1] in EXTENSIONS.values():
+                continue
+            if mimetypes.guess_type(name)[0] not in compressible:
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+                continue
+            for encoding in encodings():
+                compressed = compress(data, encoding, levels[encoding])
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + EXTENSIONS[encoding], "wb") as f:
+                    f.write(compressed)
+                written.append(path + EXTENSIONS[encoding])
+    return written
+
+
+def init_app(app):
+    """Serve the static files through :class:`StaticAssets`."""
+    assets = app.extensions["sonic_assets"] = StaticAssets(app)
+    app.url_defaults(assets.url_defaults)
+    app.view_functions["static"] = assets.send
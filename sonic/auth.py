@@ -11,9 +11,14 @@ from flask import (
     url_for,
     current_app as app,
 )
-from werkzeug.security import check_password_hash, generate_password_hash
+from itsdangerous import BadSignature, URLSafeTimedSerializer
 from sqlalchemy import text
-from sonic.db import get_db
+from werkzeug.exceptions import abort
+from sonic import aio, sessions
+from sonic.cache import get_cache
+from sonic.db import get_db, query_budget, read_one
+from sonic.hashing import get_hasher
+from sonic.tasks import notify_later
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -24,6 +29,9 @@ def login_required(view):
     @functools.wraps(view)
     def wrapped_view(**kwargs):
         if g.user is None:
+            # API clients can't follow a redirect to the login form.
+            if request.blueprint == "api":
+                abort(401)
             return redirect(url_for("auth.login"))
 
         return view(**kwargs)
@@ -31,26 +39,91 @@ def login_required(view):
     return wrapped_view
 
 
+def _token_serializer():
+    return URLSafeTimedSerializer(app.secret_key, salt="sonic-api-token")
+
+
+def generate_token(user_id):
+    """Create a signed API token for a user.
+
+    Tokens are valid for ``API_TOKEN_MAX_AGE`` seconds and are checked
+    without a database query.
+    """
+    return _token_serializer().dumps({"user_id": user_id})
+
+
+def verify_token(token):
+    """Get the user id from an API token, or ``None`` if it isn't valid."""
+    try:
+        data = _token_serializer().loads(
+            token, max_age=app.config["API_TOKEN_MAX_AGE"]
+        )
+    except BadSignature:
+        return None
+    return data.get("user_id")
+
+
+def get_user_identity(user_id):
+    """Get the public identity of a user, using the user cache.
+
+    Only the columns the templates need are loaded, never the password
+    hash.
+
+    :param user_id: id of the user to get
+    :return: a dict with the user's ``id`` and ``username``, or ``None``
+    """
+    cache = get_cache("user")
+    user = cache.get(user_id)
+    if user is None:
+        row = read_one(
+            text("SELECT id, username FROM user WHERE id = :id"), {"id": user_id}
+        )
+        if row is not None:
+            user = dict(row._mapping)
+            cache.set(user_id, user)
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop a user from the user cache.
+
+    Call this after changing anything about a user that is shown in the
+    templates, such as the username, not on login or logout. Also drops
+    the identities stored with server-side sessions, see
+    :meth:`SQLiteSessionStore.forget_user
+    <sonic.sessions.SQLiteSessionStore.forget_user>`.
+    """
+    get_cache("user").delete(user_id)
+    store = sessions.get_store(app)
+    if store is not None:
+        store.forget_user(user_id)
+
+
 @bp.before_app_request
 def load_logged_in_user():
-    """If a user id is stored in the session, load the user object from
-    the database into ``g.user``."""
+    """If a user id is stored in the session or given by an API token,
+    load the user identity from the server-side session, the user cache
+    or the database into ``g.user``."""
     user_id = session.get("user_id")
+    if request.authorization and request.authorization.type == "bearer":
+        user_id = verify_token(request.authorization.token)
 
     if user_id is None:
         g.user = None
-        app.logger.info("No user logged in.")
+        app.logger.debug("No user logged in.")
     else:
-        g.user = get_db().execute(
-            text("SELECT * FROM user WHERE id = :id"), {"id": user_id}
-        ).mappings().fetchone()
+        g.user = sessions.session_identity(user_id)
+        if g.user is None:
+            g.user = get_user_identity(user_id)
+            sessions.remember_identity(g.user)
         if g.user:
-            app.logger.info(f"User {g.user['username']} (ID: {user_id}) logged in.")
+            app.logger.debug(f"User {g.user['username']} (ID: {user_id}) logged in.")
         else:
             app.logger.warning(f"User with id {user_id} failed login.")
 
 
 @bp.route("/register", methods=("GET", "POST"))
+@query_budget(2)
 def register():
     """Register a new user with an email and role."""
     if request.method == "POST":
@@ -68,12 +141,15 @@ def register():
             error = "Password is required."
 
         if error is None:
+            password_hash = get_hasher().hash(password)
             try:
-                get_db().execute(
+                result = get_db().execute(
                     text("INSERT INTO user (username, email, password, role) VALUES (:username, :email, :password, :role)"),
-                    {"username": username, "email": email, "password": generate_password_hash(password), "role": role},
+                    {"username": username, "email": email, "password": password_hash, "role": role},
                 )
+                notify_later(f"{username} registered.")
                 get_db().commit()
+                get_cache("user").delete(result.lastrowid)
                 app.logger.info(f"User {username} registered successfully.")
             except Exception as e:
                 error = "Registration failed."
@@ -89,39 +165,83 @@ def register():
     return render_template("auth/register.html")
 
 
+_LOGIN_QUERY = text("SELECT * FROM user WHERE username = :username")
+
+
+def _login_response(username, password, user, password_ok):
+    """Finish a login attempt once the user and password have been checked."""
+    if user is None:
+        error = "Incorrect username."
+    elif not password_ok:
+        error = "Incorrect password."
+    else:
+        if get_hasher().needs_rehash(user["password"]):
+            get_hasher().rehash_later(user["id"], user["password"], password)
+        # store the user id in a new session and return to the index, with
+        # the identity loaded fresh. The user's other sessions keep theirs.
+        get_cache("user").delete(user["id"])
+        # Keep reading the user's own writes from the primary
+        wrote_at = session.get("db_wrote_at")
+        session.clear()
+        if wrote_at is not None:
+            session["db_wrote_at"] = wrote_at
+        session["user_id"] = user["id"]
+        sessions.remember_identity({"id": user["id"], "username": user["username"]})
+        app.logger.info(f"User {username} logged in successfully.")
+        return redirect(url_for("index"))
+
+    app.logger.warning(f"Login attempt failed: {error} for username {username}")
+    flash(error)
+    app.logger.error(f"Login error: {error}")
+    return render_template("auth/login.html")
+
+
 @bp.route("/login", methods=("GET", "POST"))
+@query_budget(2)
 def login():
     """Log in a registered user by adding the user id to the session."""
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        error = None
-        user = get_db().execute(
-            text("SELECT * FROM user WHERE username = :username"), {"username": username}
-        ).mappings().fetchone()
+        user = (
+            get_db().execute(_LOGIN_QUERY, {"username": username}).mappings().fetchone()
+        )
+        password_ok = user is not None and get_hasher().verify(
+            user["password"], password
+        )
+        return _login_response(username, password, user, password_ok)
 
-        if user is None:
-            error = "Incorrect username."
-            app.logger.warning(f"Login attempt failed: {error} for username {username}")
-        elif not check_password_hash(user["password"], password):
-            error = "Incorrect password."
-            app.logger.warning(f"Login attempt failed: {error} for username {username}")
+    return render_template("auth/login.html")
 
-        if error is None:
-            # store the user id in a new session and return to the index
-            session.clear()
-            session["user_id"] = user["id"]
-            app.logger.info(f"User {username} logged in successfully.")
-            return redirect(url_for("index"))
 
-        flash(error)
-        app.logger.error(f"Login error: {error}")
+@query_budget(2)
+async def login_async():
+    """Log in like :func:`login`, awaiting the database and the hash check.
+
+    Serves ``/auth/login`` instead of :func:`login` when ``ASYNC_VIEWS``
+    is set.
+    """
+    if request.method == "POST":
+        username = request.form["username"]
+        password = request.form["password"]
+        result = await aio.execute(_LOGIN_QUERY, {"username": username})
+        user = result.mappings().fetchone()
+        password_ok = user is not None and await get_hasher().verify_async(
+            user["password"], password
+        )
+        return _login_response(username, password, user, password_ok)
 
     return render_template("auth/login.html")
 
 
 @bp.route("/logout")
 def logout():
-    """Clear the current session, including the stored user id."""
+    """Clear the current session, including the stored user id.
+
+    Server-side sessions are deleted from the store.
+    """
+    user_id = session.get("user_id")
+    if user_id is not None:
+        get_cache("user").delete(user_id)
     session.clear()
     return redirect(url_for("index"))
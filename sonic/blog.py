@@ -1,3 +1,7 @@
+import base64
+import uuid
+from datetime import timezone
+
 from flask import (
     Blueprint,
     flash,
@@ -5,40 +9,418 @@ from flask import (
     redirect,
     render_template,
     request,
+    stream_template,
     url_for,
+    session,
     current_app as app,
 )
+from markupsafe import Markup
 from werkzeug.exceptions import abort
-from sqlalchemy import text
+from werkzeug.http import is_resource_modified
+from sqlalchemy import DateTime, bindparam, text
 from datetime import datetime
 
+from sonic import aio
 from sonic.auth import login_required
-from sonic.db import get_db
+from sonic.cache import get_cache
+from sonic.db import get_db, get_read_db, query_budget, read_one
+from sonic.tasks import notify_later
 
 bp = Blueprint("blog", __name__)
 
 
+def encode_cursor(created, id):
+    """Encode a ``(created, id)`` keyset position as an opaque URL token."""
+    raw = f"{created.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Decode a token produced by :func:`encode_cursor`.
+
+    :return: tuple of ``(created, id)``, with ``created`` as a datetime
+    :raise 400: if the token is malformed
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created, id = base64.urlsafe_b64decode(padded).decode().rsplit("|", 1)
+        return datetime.fromisoformat(created), int(id)
+    except ValueError:
+        abort(400, "Invalid page cursor.")
+
+
+# Columns that can be selected from the post queries, by result name.
+POST_COLUMNS = {
+    "id": "p.id",
+    "title": "title",
+    "body": "body",
+    "created": "created",
+    "author_id": "author_id",
+    "username": "author_username AS username",
+}
+
+
+def select_posts(fields=None, preview=None):
+    """Build the ``SELECT ... FROM`` part of a post query.
+
+    ``id`` and ``created`` are always selected because the page cursors
+    are made from them. The author's name is stored on the post, so the
+    user table is never joined.
+
+    The queries return SQLAlchemy rows, named tuples holding only the
+    selected columns, which templates and views read by attribute.
+
+    :param fields: names from :data:`POST_COLUMNS`, or ``None`` for all
+    :param preview: select the first ``preview`` characters of the body
+        as ``preview``, and whether it was cut as ``truncated``, instead
+        of the whole ``body``
+    """
+    names = ["id", "created"]
+    names += [name for name in fields or POST_COLUMNS if name not in names]
+    columns = [POST_COLUMNS[name] for name in names]
+    if preview and "body" in names:
+        preview = int(preview)
+        columns[names.index("body")] = (
+            f"substr(body, 1, {preview}) AS preview,"
+            f" length(body) > {preview} AS truncated"
+        )
+    return "SELECT " + ", ".join(columns) + " FROM post p"
+
+
+def typed_post_query(sql):
+    """Make a ``text()`` post query that reads and binds typed values.
+
+    ``created`` comes back as a datetime, converted by SQLAlchemy's
+    ``DateTime`` result processor, so rows can be used as they are. A
+    ``:created`` parameter is bound in the format the column is stored
+    in, which keeps keyset comparisons on the text column in order.
+    """
+    query = text(sql)
+    if ":created" in sql:
+        query = query.bindparams(bindparam("created", type_=DateTime))
+    return query.columns(created=DateTime)
+
+
+def _posts_page_query(after=None, before=None, limit=20, fields=None, preview=None):
+    """Build the keyset query for one page of posts.
+
+    ``limit + 1`` rows are selected so the caller can tell whether there
+    is another page beyond this one.
+    """
+    params = {"limit": limit + 1}
+    if before is not None:
+        params["created"], params["id"] = decode_cursor(before)
+        where = " WHERE (created, p.id) > (:created, :id)"
+        order = " ORDER BY created ASC, p.id ASC"
+    elif after is not None:
+        params["created"], params["id"] = decode_cursor(after)
+        where = " WHERE (created, p.id) < (:created, :id)"
+        order = " ORDER BY created DESC, p.id DESC"
+    else:
+        where = ""
+        order = " ORDER BY created DESC, p.id DESC"
+
+    query = typed_post_query(
+        select_posts(fields, preview) + where + order + " LIMIT :limit"
+    )
+    return query, params
+
+
+def listing_queries():
+    """Get the post listing queries with example parameters.
+
+    Used to check their query plans, see ``flask sonic check-plans``.
+    """
+    cursor = encode_cursor(datetime(2024, 1, 1), 1)
+    return {
+        "first page": _posts_page_query(),
+        "older page": _posts_page_query(after=cursor),
+        "newer page": _posts_page_query(before=cursor),
+        "posts by id": (
+            typed_post_query(select_posts() + " WHERE p.id = :id"),
+            {"id": 1},
+        ),
+        "posts by author": (
+            typed_post_query(
+                select_posts()
+                + " WHERE author_id = :author_id"
+                " ORDER BY created DESC, p.id DESC LIMIT 20"
+            ),
+            {"author_id": 1},
+        ),
+    }
+
+
+class PostPage:
+    """A fully loaded page of posts with its pagination cursors."""
+
+    def __init__(self, posts, prev_cursor=None, next_cursor=None):
+        self.posts = posts
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+
+class PostStream:
+    """A page of posts read lazily from a server-side cursor.
+
+    Rows are read one at a time as the template consumes them, so
+    memory use does not depend on the page size. The pagination cursors
+    are only known once the rows have been consumed, so templates must
+    read them after looping over :attr:`posts`.
+    """
+
+    def __init__(self, result, limit, after=None):
+        self.result = result
+        self.limit = limit
+        self.after = after
+        self.prev_cursor = None
+        self.next_cursor = None
+
+    @property
+    def posts(self):
+        last = None
+        try:
+            for count, post in enumerate(self.result):
+                if count == self.limit:
+                    self.next_cursor = encode_cursor(last.created, last.id)
+                    break
+                if count == 0 and self.after is not None:
+                    self.prev_cursor = encode_cursor(post.created, post.id)
+                last = post
+                yield post
+        finally:
+            self.result.close()
+
+
+def get_posts_page(after=None, before=None, limit=20, fields=None, preview=None):
+    """Get one page of posts using keyset pagination on ``(created, id)``.
+
+    Only ``limit + 1`` rows are read from the ``(created, id)`` index, so
+    the cost of a page does not grow with the size of the table.
+
+    :param after: cursor of the last post on the previous page (older posts)
+    :param before: cursor of the first post on the next page (newer posts)
+    :param limit: number of posts per page
+    :param fields: columns to select, see :func:`select_posts`
+    :param preview: length of the body previews, see :func:`select_posts`
+    :return: a :class:`PostPage`
+    """
+    query, params = _posts_page_query(after, before, limit, fields, preview)
+    rows = get_read_db().execute(query, params).fetchall()
+    return _make_page(rows, after, before, limit)
+
+
+async def get_posts_page_async(
+    after=None, before=None, limit=20, fields=None, preview=None
+):
+    """Get one page of posts like :func:`get_posts_page`, with the async engine."""
+    query, params = _posts_page_query(after, before, limit, fields, preview)
+    rows = (await aio.execute(query, params)).fetchall()
+    return _make_page(rows, after, before, limit)
+
+
+def _make_page(rows, after, before, limit):
+    """Make a :class:`PostPage` from the ``limit + 1`` rows of a page query."""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+
+    # Coming back from an older page means there is always an older page,
+    # and coming from a newer page means there is always a newer one.
+    if before is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+
+    page = PostPage(rows)
+    if rows and has_prev:
+        page.prev_cursor = encode_cursor(rows[0].created, rows[0].id)
+    if rows and has_next:
+        page.next_cursor = encode_cursor(rows[-1].created, rows[-1].id)
+    return page
+
+
+def stream_posts_page(after=None, limit=20, preview=None):
+    """Get one page of older posts as a :class:`PostStream`.
+
+    The rows are fetched ``POSTS_STREAM_YIELD_PER`` at a time instead of
+    being loaded into a list up front.
+    """
+    query, params = _posts_page_query(after=after, limit=limit, preview=preview)
+    result = get_read_db().execute(
+        query,
+        params,
+        execution_options={"yield_per": app.config["POSTS_STREAM_YIELD_PER"]},
+    )
+    return PostStream(result, limit, after)
+
+
+def get_feed_state():
+    """Get the version and last modified time of the post feed.
+
+    The state lives in the page cache, so clearing that cache also starts
+    a new version. The version comes from :meth:`TTLCache.version
+    <sonic.cache.TTLCache.version>`, so the pre-forked workers send the
+    same ETags.
+
+    :return: tuple of ``(version, last_modified)``
+    """
+    cache = get_cache("page")
+    state = cache.get("feed")
+    if state is None:
+        last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        # Configured stores are shared already
+        version = cache.version() if hasattr(cache, "version") else uuid.uuid4().hex
+        state = (version, last_modified)
+        cache.set("feed", state)
+    return state
+
+
+def invalidate_feed(post_id=None):
+    """Drop the cached feed pages and the fragments of a changed post.
+
+    :param post_id: id of the post that was updated or deleted
+    """
+    get_cache("page").clear()
+    if post_id is not None:
+        fragments = get_cache("fragment")
+        fragments.delete((post_id, True))
+        fragments.delete((post_id, False))
+
+
+@bp.app_template_global()
+def render_post(post):
+    """Render the ``<article>`` for a post, using the fragment cache.
+
+    Fragments differ only by whether the current user can edit the post.
+    """
+    is_author = g.user is not None and g.user["id"] == post.author_id
+    key = (post.id, is_author)
+    cache = get_cache("fragment")
+    html = cache.get(key)
+    if html is None:
+        template = app.jinja_env.get_template("blog/_post.html")
+        html = Markup(template.render(post=post, is_author=is_author))
+        cache.set(key, html)
+    return html
+
+
+def _index_args():
+    """Get the ``after``, ``before`` and ``per_page`` arguments of the index."""
+    after = request.args.get("after")
+    before = request.args.get("before")
+    limit = min(
+        request.args.get("per_page", app.config["POSTS_PER_PAGE"], type=int),
+        app.config["POSTS_PER_PAGE_MAX"],
+    )
+    if limit < 1:
+        abort(400, "Invalid page size.")
+    return after, before, limit
+
+
+def _feed_etag(version):
+    """Get the ETag of the index for the current user."""
+    user_id = g.user["id"] if g.user else 0
+    return f"{version}-{user_id}"
+
+
+def _cached_index(version):
+    """Get the rendered index from the page cache, for anonymous users.
+
+    Pages are keyed by the feed version read before rendering, so a page
+    rendered while the feed changed is never served for the new version.
+    """
+    return None if g.user else get_cache("page").get((version, request.full_path))
+
+
+def _cache_index(version, html):
+    if g.user is None:
+        get_cache("page").set((version, request.full_path), html)
+    return html
+
+
+def _index_response(html, etag, last_modified):
+    """Make the index response, a 304 if ``html`` is ``None``."""
+    if html is None:
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(html)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    if g.user:
+        response.cache_control.private = True
+    return response
+
+
 @bp.route("/")
+@query_budget(2)
 def index():
-    """Show all the posts, most recent first."""
-    posts = get_db().execute(
-        text(
-            "SELECT p.id, title, body, created, author_id, username"
-            " FROM post p JOIN user u ON p.author_id = u.id"
-            " ORDER BY created DESC"
-        )
-    ).mappings().fetchall()
+    """Show a page of posts, most recent first.
 
-    # Convert each RowMapping to a dictionary and update 'created'
-    formatted_posts = []
-    for post in posts:
-        post_dict = dict(post)  # Convert RowMapping to a dictionary
-        if isinstance(post_dict['created'], str):
-            post_dict['created'] = datetime.strptime(post_dict['created'], "%Y-%m-%d %H:%M:%S")
-        formatted_posts.append(post_dict)
+    Pass ``stream=1`` (or set ``POSTS_STREAM``) to send the page while
+    the rows are still being read, and ``per_page`` to change the page
+    size up to ``POSTS_PER_PAGE_MAX``. Set ``POSTS_PREVIEW_CHARS`` to
+    only load and show the start of each post.
+    """
+    after, before, limit = _index_args()
+    preview = app.config["POSTS_PREVIEW_CHARS"]
 
-    app.logger.info("Fetched all posts for the index page.")
-    return render_template("blog/index.html", posts=formatted_posts)
+    # Newer pages are read in reverse order, so they can't be streamed.
+    streaming = request.args.get(
+        "stream", app.config["POSTS_STREAM"], type=lambda v: v in ("1", "true")
+    )
+    if streaming and before is None:
+        page = stream_posts_page(after=after, limit=limit, preview=preview)
+        app.logger.debug("Streaming a page of posts for the index page.")
+        return stream_template("blog/index.html", page=page)
+
+    # Pages showing flashed messages are one-offs, don't cache them.
+    if "_flashes" in session:
+        page = get_posts_page(after=after, before=before, limit=limit, preview=preview)
+        return render_template("blog/index.html", page=page)
+
+    version, last_modified = get_feed_state()
+    etag = _feed_etag(version)
+    if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+        return _index_response(None, etag, last_modified)
+    html = _cached_index(version)
+    if html is None:
+        page = get_posts_page(after=after, before=before, limit=limit, preview=preview)
+        app.logger.info("Fetched a page of posts for the index page.")
+        html = _cache_index(version, render_template("blog/index.html", page=page))
+    return _index_response(html, etag, last_modified)
+
+
+@query_budget(2)
+async def index_async():
+    """Show a page of posts like :func:`index`, read with the async engine.
+
+    Serves ``/`` instead of :func:`index` when ``ASYNC_VIEWS`` is set.
+    Pages are never streamed.
+    """
+    after, before, limit = _index_args()
+    preview = app.config["POSTS_PREVIEW_CHARS"]
+
+    if "_flashes" in session:
+        page = await get_posts_page_async(
+            after=after, before=before, limit=limit, preview=preview
+        )
+        return render_template("blog/index.html", page=page)
+
+    version, last_modified = get_feed_state()
+    etag = _feed_etag(version)
+    if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+        return _index_response(None, etag, last_modified)
+    html = _cached_index(version)
+    if html is None:
+        page = await get_posts_page_async(
+            after=after, before=before, limit=limit, preview=preview
+        )
+        app.logger.info("Fetched a page of posts for the index page.")
+        html = _cache_index(version, render_template("blog/index.html", page=page))
+    return _index_response(html, etag, last_modified)
 
 
 def get_post(id, check_author=True):
@@ -53,24 +435,19 @@ def get_post(id, check_author=True):
     :raise 404: if a post with the given id doesn't exist
     :raise 403: if the current user isn't the author
     """
-    post = get_db().execute(
-        text(
-            "SELECT p.id, title, body, created, author_id, username"
-            " FROM post p JOIN user u ON p.author_id = u.id"
-            " WHERE p.id = :id"
+    post = read_one(
+        typed_post_query(
+            "SELECT id, title, body, created, author_id,"
+            " author_username AS username FROM post WHERE id = :id"
         ),
         {"id": id},
-    ).mappings().fetchone()
+    )
 
     if post is None:
         app.logger.warning(f"Post with id {id} does not exist.")
         abort(404, f"Post id {id} doesn't exist.")
 
-    # Convert RowMapping to a dictionary and update 'created'
-    post_dict = dict(post)
-    post_dict['created'] = datetime.strptime(post_dict['created'], "%Y-%m-%d %H:%M:%S")
-
-    if check_author and post["author_id"] != g.user["id"]:
+    if check_author and post.author_id != g.user["id"]:
         app.logger.warning(
             f"User {g.user['id']} tried to access a post they don't own."
         )
@@ -81,6 +458,7 @@ def get_post(id, check_author=True):
 
 @bp.route("/create", methods=("GET", "POST"))
 @login_required
+@query_budget(3)
 def create():
     """Create a new post for the current user."""
     if request.method == "POST":
@@ -96,12 +474,16 @@ def create():
             flash(error)
             app.logger.error(f"Flashed error: {error}")
         else:
-            created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")  # Current timestamp
+            created = datetime.now().replace(microsecond=0)
             get_db().execute(
-                text("INSERT INTO post (title, body, author_id, created) VALUES (:title, :body, :author_id, :created)"),
-                {"title": title, "body": body, "author_id": g.user["id"], "created": created},
+                text("INSERT INTO post (title, body, author_id, author_username, created) VALUES (:title, :body, :author_id, :author_username, :created)").bindparams(
+                    bindparam("created", type_=DateTime)
+                ),
+                {"title": title, "body": body, "author_id": g.user["id"], "author_username": g.user["username"], "created": created},
             )
+            notify_later(f"{g.user['username']} posted \"{title}\"")
             get_db().commit()
+            invalidate_feed()
             app.logger.info(f"User {g.user['id']} created a new post titled '{title}'.")
             return redirect(url_for("blog.index"))
 
@@ -109,6 +491,7 @@ def create():
 
 @bp.route("/<int:id>/update", methods=("GET", "POST"))
 @login_required
+@query_budget(3)
 def update(id):
     """Update a post if the current user is the author."""
     post = get_post(id)
@@ -131,6 +514,7 @@ def update(id):
                 {"title": title, "body": body, "id": id},
             )
             get_db().commit()
+            invalidate_feed(id)
             app.logger.info(
                 f"User {g.user['id']} updated post id {id} with new title '{title}'."
             )
@@ -140,6 +524,7 @@ def update(id):
 
 @bp.route("/<int:id>/delete", methods=("POST",))
 @login_required
+@query_budget(3)
 def delete(id):
     """Delete a post.
 
@@ -149,5 +534,6 @@ def delete(id):
     get_post(id)
     get_db().execute(text("DELETE FROM post WHERE id = :id"), {"id": id})
     get_db().commit()
+    invalidate_feed(id)
     app.logger.info(f"User {g.user['id']} deleted post id {id}.")
     return redirect(url_for("blog.index"))
@@ -0,0 +1,213 @@
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.utils import import_string
+
+
+_DELETE = 0
+_CLEAR = 1
+
+
+class InvalidationBus:
+    """Pass cache deletes and clears on to the other server processes.
+
+    The events are kept in a ring in shared memory, which must be created
+    before the processes are forked. Keys are sent as their ``hash()``,
+    which forked processes agree on. A process that falls more than
+    ``size`` events behind clears its caches instead.
+
+    Clears are also counted by cache, see :meth:`TTLCache.version`.
+    """
+
+    def __init__(self, size=4096, counters=256):
+        # Only the pre-fork server needs multiprocessing.
+        import multiprocessing
+
+        context = multiprocessing.get_context("fork")
+        self.size = size
+        # The sequence number, then (cache, event, key hash) per slot
+        self._array = context.Array("q", 1 + 3 * size)
+        self._events = self._array.get_obj()
+        # Clears by cache id, caches sharing a counter only change
+        # versions more often. Updated with the lock of the ring.
+        self._clears = context.Array("q", counters, lock=False)
+        self.token = uuid.uuid4().hex[:12]
+
+    def sequence(self):
+        """Get the number of the last event, without locking."""
+        return self._events[0]
+
+    def publish(self, cache_id, event, key_hash=0):
+        """Add an event to the ring.
+
+        :return: the number of the event
+        """
+        with self._array.get_lock():
+            sequence = self._events[0] + 1
+            slot = 1 + 3 * (sequence % self.size)
+            self._events[slot : slot + 3] = [cache_id, event, key_hash]
+            self._events[0] = sequence
+            if event == _CLEAR:
+                self._clears[cache_id % len(self._clears)] += 1
+        return sequence
+
+    def clears(self, cache_id):
+        """Get the number of clears published for a cache."""
+        return self._clears[cache_id % len(self._clears)]
+
+    def since(self, sequence):
+        """Get the events after ``sequence``.
+
+        :return: tuple of ``(last sequence, events)``, events is ``None``
+            if some of them were already overwritten
+        """
+        with self._array.get_lock():
+            last = self._events[0]
+            if last - sequence > self.size:
+                return last, None
+            events = []
+            for number in range(sequence + 1, last + 1):
+                slot = 1 + 3 * (number % self.size)
+                events.append(tuple(self._events[slot : slot + 3]))
+        return last, events
+
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    Any object with the same ``get``/``set``/``delete``/``clear`` methods
+    can be configured in its place, for example a wrapper around a shared
+    store.
+
+    With a ``bus``, deletes and clears are also applied to the cache of
+    the same ``name`` in the other processes, see :func:`share_invalidations`.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, bus=None, name=""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._bus = bus
+        self._id = zlib.crc32(name.encode())
+        self._seen = bus.sequence() if bus else 0
+        self._token = uuid.uuid4().hex[:12]
+        self._clears = 0
+
+    def _sync(self):
+        """Apply the events other processes published since the last call."""
+        if self._bus.sequence() == self._seen:
+            return
+        self._seen, events = self._bus.since(self._seen)
+        if events is None:
+            self._data.clear()
+            return
+        hashes = set()
+        for cache_id, event, key_hash in events:
+            if cache_id != self._id:
+                continue
+            if event == _CLEAR:
+                self._data.clear()
+            else:
+                hashes.add(key_hash)
+        if hashes and self._data:
+            for key in [key for key in self._data if hash(key) in hashes]:
+                del self._data[key]
+
+    def _publish(self, event, key_hash=0):
+        sequence = self._bus.publish(self._id, event, key_hash)
+        if sequence == self._seen + 1:
+            # Nothing to apply from others, and this one is applied already
+            self._seen = sequence
+
+    def get(self, key, default=None):
+        with self._lock:
+            if self._bus is not None:
+                self._sync()
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            if self._bus is not None:
+                self._publish(_DELETE, hash(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._clears += 1
+            if self._bus is not None:
+                self._publish(_CLEAR)
+
+    def version(self):
+        """Get a version of the cache contents that changes with every clear.
+
+        Processes sharing a bus agree on it. It also changes when the
+        server restarts.
+        """
+        if self._bus is not None:
+            return f"{self._bus.token}-{self._bus.clears(self._id)}"
+        return f"{self._token}-{self._clears}"
+
+
+def _make_cache(app, name):
+    """Create the cache called ``name`` from the ``<NAME>_CACHE_*`` config."""
+    prefix = f"{name.upper()}_CACHE"
+    store = app.config.get(f"{prefix}_STORE")
+
+    if store is None:
+        return TTLCache(
+            maxsize=app.config.get(f"{prefix}_SIZE", 1024),
+            ttl=app.config.get(f"{prefix}_TTL", 300),
+            bus=app.extensions.get("sonic_cache_bus"),
+            name=name,
+        )
+    if isinstance(store, str):
+        # An import path to a store class or factory
+        return import_string(store)(app)
+    return store
+
+
+def get_cache(name):
+    """Get the named cache for the current app, creating it on first use."""
+    caches = current_app.extensions["sonic_cache"]
+    cache = caches.get(name)
+    if cache is None:
+        cache = caches.setdefault(name, _make_cache(current_app, name))
+    return cache
+
+
+def share_invalidations(app):
+    """Keep the in-process caches of forked server processes consistent.
+
+    Call before forking: afterwards, a delete or clear in one process
+    also drops the entry from the other processes' caches. Configured
+    stores are expected to be shared already and are left alone.
+    """
+    app.extensions["sonic_cache_bus"] = InvalidationBus()
+    # Recreate the caches with the bus on first use
+    app.extensions["sonic_cache"].clear()
+
+
+def init_app(app):
+    """Register the cache registry with the Flask app."""
+    app.extensions["sonic_cache"] = {}
@@ -0,0 +1,423 @@
+import csv
+import itertools
+import json
+import multiprocessing
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.engine import make_url
+from werkzeug.security import generate_password_hash
+
+from sonic.assets import compress_static
+from sonic.blog import listing_queries
+from sonic.db import db, explain, plan_problems
+from sonic.sessions import SQLiteSessionStore
+from sonic.templating import compile_templates
+
+sonic = AppGroup("sonic", help="Sonic maintenance commands.")
+
+
+def _sqlite_path(uri):
+    url = make_url(uri)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise click.ClickException(f"{url!r} is not a SQLite database file.")
+    return url.database
+
+
+@sonic.command("replicate")
+@click.option(
+    "--pages",
+    default=1024,
+    show_default=True,
+    help="Pages copied per step, so readers of the replica aren't blocked.",
+)
+def replicate(pages):
+    """Copy the primary database to the read replica.
+
+    Uses the SQLite online backup API, so the primary stays available
+    for writes while it is copied. Run this periodically when
+    SQLALCHEMY_READ_URI points at a SQLite file.
+    """
+    read_uri = current_app.config["SQLALCHEMY_READ_URI"]
+    if not read_uri:
+        raise click.ClickException("SQLALCHEMY_READ_URI is not configured.")
+
+    source = sqlite3.connect(
+        _sqlite_path(current_app.config["SQLALCHEMY_DATABASE_URI"])
+    )
+    target = sqlite3.connect(_sqlite_path(read_uri))
+    try:
+        with target:
+            source.backup(target, pages=pages)
+    finally:
+        target.close()
+        source.close()
+
+    click.echo(f"Replicated the primary database to {read_uri}.")
+
+
+@sonic.command("reindex")
+def reindex():
+    """Rebuild the full text search index from the post table.
+
+    The triggers keep the index up to date, so this is only needed after
+    loading posts with the triggers disabled or if the index is damaged.
+    """
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO post_fts(post_fts) VALUES ('rebuild')"))
+        conn.execute(text("INSERT INTO post_fts(post_fts) VALUES ('optimize')"))
+        count = conn.execute(text("SELECT count(*) FROM post")).scalar()
+
+    click.echo(f"Rebuilt the search index for {count} posts.")
+
+
+# Columns written by ``export`` and read by ``import``, per table.
+EXPORT_QUERIES = {
+    "users": "SELECT id, username, email, password AS password_hash FROM user ORDER BY id",
+    "posts": "SELECT id, author_id, created, title, body FROM post ORDER BY id",
+}
+IMPORT_QUERIES = {
+    "users": (
+        "INSERT INTO user (id, username, email, password)"
+        " VALUES (:id, :username, :email, :password)"
+    ),
+    # Setting author_username saves the trigger an UPDATE per post
+    "posts": (
+        "INSERT INTO post (id, author_id, author_username, created, title, body)"
+        " VALUES (:id, :author_id, (SELECT username FROM user WHERE id = :author_id),"
+        " :created, :title, :body)"
+    ),
+}
+
+
+# Triggers that only maintain derived data, dropped while loading a table
+# and replaced by one rebuild at the end.
+IMPORT_DEFERRED_TRIGGERS = {"posts": ("post_fts_ai",)}
+IMPORT_REBUILDS = {"posts": ("INSERT INTO post_fts(post_fts) VALUES ('rebuild')",)}
+# Page cache of the loading connection, in KiB, so index pages stay cached
+IMPORT_CACHE_KIB = 262144
+
+
+def _drop_triggers(conn, names):
+    """Drop the named triggers.
+
+    :return: the ``CREATE TRIGGER`` statements of those that existed
+    """
+    saved = []
+    with conn.begin():
+        for name in names:
+            sql = conn.execute(
+                text(
+                    "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+                ),
+                {"name": name},
+            ).scalar()
+            if sql is not None:
+                saved.append(sql)
+                conn.exec_driver_sql(f"DROP TRIGGER {name}")
+    return saved
+
+
+def _guess_format(file, format):
+    if format is not None:
+        return format
+    return "csv" if getattr(file, "name", "").endswith(".csv") else "ndjson"
+
+
+def _read_records(file, format):
+    """Yield the records of an NDJSON or CSV file one at a time."""
+    if format == "csv":
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _optional(value, convert=str):
+    # CSV has no null, so empty strings stand in for missing values.
+    return None if value in (None, "") else convert(value)
+
+
+def _user_row(record):
+    return {
+        "id": _optional(record.get("id"), int),
+        "username": record["username"],
+        "email": record["email"],
+        "password": _optional(record.get("password_hash")),
+        "plain": _optional(record.get("password")),
+    }
+
+
+def _post_row(record):
+    return {
+        "id": _optional(record.get("id"), int),
+        "author_id": int(record["author_id"]),
+        # Parsed so every row is stored in the DateTime column's format.
+        "created": _optional(record.get("created"), datetime.fromisoformat)
+        or datetime.now().replace(microsecond=0),
+        "title": record["title"],
+        "body": record.get("body") or "",
+    }
+
+
+class _Progress:
+    """Report the number of rows done and the rate on stderr."""
+
+    def __init__(self, verb):
+        self.verb = verb
+        self.count = 0
+        self.start = time.perf_counter()
+
+    @property
+    def rate(self):
+        return self.count / max(time.perf_counter() - self.start, 1e-9)
+
+    def update(self, count):
+        self.count += count
+        click.echo(f"{self.verb} {self.count} rows ({self.rate:.0f} rows/s)", err=True)
+
+
+@sonic.command("export")
+@click.argument("table", type=click.Choice(tuple(EXPORT_QUERIES)))
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+@click.option(
+    "--format", type=click.Choice(("ndjson", "csv")), help="Default from the file name."
+)
+@click.option("--batch-size", default=10_000, show_default=True)
+def export(table, output, format, batch_size):
+    """Write all users or posts to OUTPUT as NDJSON or CSV.
+
+    Rows are streamed from the database in batches, so memory use stays
+    flat however big the table is. User passwords are exported as their
+    hashes, ready to be imported again.
+    """
+    format = _guess_format(output, format)
+    progress = _Progress("Exported")
+    with db.engine.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(
+            text(EXPORT_QUERIES[table])
+        )
+        writer = None
+        if format == "csv":
+            writer = csv.DictWriter(output, result.keys(), lineterminator="\n")
+            writer.writeheader()
+        for rows in result.mappings().partitions():
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                output.writelines(
+                    json.dumps(dict(row), default=str) + "\n" for row in rows
+                )
+            progress.update(len(rows))
+
+    click.echo(
+        f"Exported {progress.count} {table} in {progress.rate:.0f} rows/s.", err=True
+    )
+
+
+def _hash_passwords(rows, pool, method):
+    """Hash the plain text passwords of a batch of users in the pool."""
+    pending = [row for row in rows if row["password"] is None]
+    if any(row["plain"] is None for row in pending):
+        raise click.ClickException("Every user needs a password or password_hash.")
+    hashes = pool.map(
+        generate_password_hash,
+        [row["plain"] for row in pending],
+        itertools.repeat(method),
+        chunksize=16,
+    )
+    for row, password_hash in zip(pending, hashes):
+        row["password"] = password_hash
+
+
+@sonic.command("import")
+@click.argument("table", type=click.Choice(tuple(IMPORT_QUERIES)))
+@click.argument("input", type=click.File("r", encoding="utf-8"), default="-")
+@click.option(
+    "--format", type=click.Choice(("ndjson", "csv")), help="Default from the file name."
+)
+@click.option(
+    "--batch-size", default=5000, show_default=True, help="Rows per transaction."
+)
+@click.option(
+    "--hash-workers",
+    default=multiprocessing.cpu_count(),
+    show_default=True,
+    help="Processes hashing plain text user passwords.",
+)
+def import_(table, input, format, batch_size, hash_workers):
+    """Load users or posts from INPUT, as written by ``export``.
+
+    Users need either a ``password_hash`` (used as is) or a plain text
+    ``password``, which is hashed in parallel with the configured
+    method. Posts are attributed by ``author_id``, so import the users
+    first. Rows without an ``id`` get a new one.
+
+    Each batch is one executemany INSERT in its own transaction. With
+    SQLite, the search index trigger is dropped during a posts import
+    and the index is rebuilt once at the end, like ``reindex``, and the
+    load uses a larger page cache. Searches don't find the new posts
+    until the import is done.
+    """
+    format = _guess_format(input, format)
+    make_row = _user_row if table == "users" else _post_row
+    records = _read_records(input, format)
+    insert = text(IMPORT_QUERIES[table])
+    if table == "posts":
+        insert = insert.bindparams(bindparam("created", type_=DateTime))
+
+    pool = None
+    if table == "users":
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(hash_workers, mp_context=context)
+
+    progress = _Progress("Imported")
+    sqlite = db.engine.dialect.name == "sqlite"
+    deferred = []
+    with db.engine.connect() as conn:
+        if sqlite:
+            conn.exec_driver_sql(f"PRAGMA cache_size = -{IMPORT_CACHE_KIB}")
+            conn.commit()
+            deferred = _drop_triggers(conn, IMPORT_DEFERRED_TRIGGERS.get(table, ()))
+        try:
+            while True:
+                try:
+                    rows = [
+                        make_row(record)
+                        for record in itertools.islice(records, batch_size)
+                    ]
+                except (KeyError, ValueError) as error:
+                    raise click.ClickException(
+                        f"Bad record after row {progress.count}: {error!r}"
+                    )
+                if not rows:
+                    break
+                if pool is not None:
+                    _hash_passwords(
+                        rows, pool, current_app.config["PASSWORD_HASH_METHOD"]
+                    )
+                with conn.begin():
+                    conn.execute(insert, rows)
+                progress.update(len(rows))
+        finally:
+            if deferred:
+                with conn.begin():
+                    for sql in deferred:
+                        conn.exec_driver_sql(sql)
+                    for sql in IMPORT_REBUILDS.get(table, ()):
+                        conn.exec_driver_sql(sql)
+            if sqlite:
+                cache_size = current_app.config["SQLITE_PRAGMAS"].get(
+                    "cache_size", -2000
+                )
+                conn.exec_driver_sql(f"PRAGMA cache_size = {cache_size}")
+                conn.commit()
+            if pool is not None:
+                pool.shutdown()
+
+    click.echo(
+        f"Imported {progress.count} {table} in {progress.rate:.0f} rows/s.", err=True
+    )
+
+
+@sonic.command("worker")
+@click.option("--concurrency", default=2, show_default=True, help="Jobs run at once.")
+@click.option("--once", is_flag=True, help="Exit when no jobs are due.")
+def worker(concurrency, once):
+    """Run background jobs from the job table.
+
+    Set TASK_MODE to "worker" on the web servers so that jobs only run
+    in worker processes. Workers and servers can share the job table,
+    each job is claimed by a single runner.
+    """
+    click.echo(f"Running jobs with {concurrency} threads.", err=True)
+    count = current_app.extensions["sonic_jobs"].work(concurrency, once)
+    click.echo(f"Ran {count} jobs.", err=True)
+
+
+def check_listing_plans():
+    """Get the query plan of every post listing query.
+
+    :return: dict of query name to ``(steps, problems)``
+    """
+    plans = {}
+    for name, (query, params) in listing_queries().items():
+        steps = explain(query, params)
+        plans[name] = (steps, plan_problems(steps))
+    return plans
+
+
+@sonic.command("check-plans")
+def check_plans():
+    """Check that the post listing queries use their indexes.
+
+    Fails if a query plan scans a whole table or sorts the rows in a
+    temporary B-tree, which gets slower with every post.
+    """
+    failed = False
+    for name, (steps, problems) in check_listing_plans().items():
+        click.echo(f"{name}: {'FAIL' if problems else 'ok'}")
+        for step in steps:
+            click.echo(f"    {step}")
+        failed = failed or bool(problems)
+    if failed:
+        raise click.ClickException("Some listing queries don't use an index.")
+
+
+@sonic.command("compile-templates")
+def compile_templates_command():
+    """Compile every template into the bytecode cache.
+
+    Run this when building a deployment so the first requests after a
+    restart load compiled templates from TEMPLATE_CACHE_DIR.
+    """
+    if not current_app.config["TEMPLATE_CACHE_DIR"]:
+        raise click.ClickException("TEMPLATE_CACHE_DIR is not configured.")
+    count = compile_templates(current_app)
+    click.echo(
+        f"Compiled {count} templates into {current_app.config['TEMPLATE_CACHE_DIR']}."
+    )
+
+
+@sonic.command("compress-static")
+def compress_static_command():
+    """Write precompressed copies of the static files.
+
+    Run this when building a deployment so the static files are sent
+    compressed without compressing them on every request.
+    """
+    written = compress_static(current_app)
+    for path in written:
+        click.echo(path)
+    click.echo(f"Wrote {len(written)} compressed files.")
+
+
+@sonic.command("revoke-sessions")
+@click.argument("username")
+def revoke_sessions_command(username):
+    """Log USERNAME out everywhere by deleting their server-side sessions.
+
+    Only affects SESSION_BACKEND = "sqlite", cookie sessions can't be
+    revoked. Running servers may still accept the sessions from memory
+    for up to SESSION_CACHE_TTL seconds.
+    """
+    user_id = db.session.execute(
+        text("SELECT id FROM user WHERE username = :username"),
+        {"username": username},
+    ).scalar()
+    if user_id is None:
+        raise click.ClickException(f"No user named {username!r}.")
+    count = SQLiteSessionStore(current_app).revoke_user(user_id)
+    click.echo(f"Revoked {count} sessions of {username}.")
+
+
+def init_app(app):
+    """Register the ``flask sonic`` commands with the Flask app."""
+    app.cli.add_command(sonic)
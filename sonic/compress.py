@@ -0,0 +1,83 @@
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is used alone without it
+    brotli = None
+
+# Content-Encoding and file extension of the supported encodings
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+
+def encodings():
+    """Get the supported encodings, the preferred first."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data, encoding, level):
+    """Compress ``data`` with ``encoding``.
+
+    :param level: the gzip level, 1-9, or the brotli quality, 0-11
+    """
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    # mtime=0 so the same data always compresses to the same bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class Compressor:
+    """Compress responses for clients that accept it.
+
+    Only complete, successful responses of ``COMPRESS_MIMETYPES`` with
+    at least ``COMPRESS_MIN_SIZE`` bytes are compressed. Streamed
+    responses and files, which include the static files, are sent as
+    they are. Brotli is preferred when the ``brotli`` package is
+    installed.
+    """
+
+    def __init__(self, app):
+        self.min_size = app.config["COMPRESS_MIN_SIZE"]
+        self.mimetypes = set(app.config["COMPRESS_MIMETYPES"])
+        self.levels = {
+            "br": app.config["COMPRESS_BR_LEVEL"],
+            "gzip": app.config["COMPRESS_GZIP_LEVEL"],
+        }
+
+    def __call__(self, response):
+        if response.mimetype not in self.mimetypes:
+            return response
+        response.vary.add("Accept-Encoding")
+        if (
+            response.status_code not in (200, 201)
+            or response.is_streamed
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or (response.content_length or 0) < self.min_size
+        ):
+            return response
+        encoding = request.accept_encodings.best_match(encodings())
+        if encoding is None:
+            return response
+
+        response.set_data(
+            compress(response.get_data(), encoding, self.levels[encoding])
+        )
+        response.content_encoding = encoding
+        # The compressed body differs byte for byte, like nginx keep only
+        # a weak ETag, which conditional requests still match.
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def init_app(app):
+    """Compress the responses when ``COMPRESS_ENABLED`` is set.
+
+    Registered last, so the request log and metrics see the size that
+    was sent.
+    """
+    if app.config["COMPRESS_ENABLED"]:
+        app.after_request(Compressor(app))
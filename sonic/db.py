@@ -1,11 +1,22 @@
+import functools
+import inspect
+import logging
 import os
-from flask import current_app, g
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_app_context, has_request_context, session
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
 
-# Initialize SQLAlchemy and Flask-Migrate
+# Initialize SQLAlchemy, Flask-Migrate is registered by init_migrate
 db = SQLAlchemy()
-migrate = Migrate()
+
+logger = logging.getLogger("sonic.db")
+
+# Query trackers that are currently recording, see QueryTracker.
+_trackers = []
 
 def get_db():
     """Get the current database session."""
@@ -13,10 +24,281 @@ def get_db():
         g.db = db.session  # Use the SQLAlchemy session
     return g.db
 
+def get_read_db():
+    """Get a database session for read-only queries.
+
+    When ``SQLALCHEMY_READ_URI`` is configured this is a session on the
+    read replica. Right after the current user commits a write, reads go
+    to the primary instead for ``DB_READ_STICKY_SECONDS``, so users
+    always see their own changes.
+    """
+    if "read_db" not in g:
+        engine = db.engines.get("read")
+        if engine is None or _recently_wrote():
+            g.read_db = get_db()
+        else:
+            g.read_db = g.read_db_session = Session(bind=engine)
+    return g.read_db
+
+def read_one(statement, params=None):
+    """Get one row with :func:`get_read_db`.
+
+    The replica is only refreshed now and then, so a row it doesn't have
+    yet is looked up on the primary before giving up.
+
+    :return: the row, or ``None`` if neither database has it
+    """
+    read_db = get_read_db()
+    row = read_db.execute(statement, params).fetchone()
+    if row is None and read_db is not get_db():
+        row = get_db().execute(statement, params).fetchone()
+    return row
+
+def _recently_wrote():
+    if not has_request_context():
+        return False
+    wrote_at = session.get("db_wrote_at")
+    sticky = current_app.config["DB_READ_STICKY_SECONDS"]
+    return wrote_at is not None and time.time() - wrote_at < sticky
+
+def _remember_write(db_session):
+    """Pin the user's reads to the primary after they commit a write."""
+    if has_request_context() and "read" in db.engines:
+        session["db_wrote_at"] = time.time()
+
+def _close_read_db(exc):
+    read_db = g.pop("read_db_session", None)
+    if read_db is not None:
+        read_db.close()
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a view runs more queries than its budget allows."""
+
+class QueryTracker:
+    """Record every statement run while the tracker is active.
+
+    Statements from all threads and engines are recorded, so use it
+    around test client calls rather than on a busy server::
+
+        with QueryTracker() as tracker:
+            client.get("/")
+        assert tracker.count <= 2
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        _trackers.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _trackers.remove(self)
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fail if the block runs more than ``limit`` queries."""
+    with QueryTracker() as tracker:
+        yield tracker
+    if tracker.count > limit:
+        statements = "\n".join(f"  {statement}" for statement in tracker.statements)
+        raise QueryBudgetExceeded(
+            f"{tracker.count} queries run, the budget is {limit}:\n{statements}"
+        )
+
+def query_budget(limit):
+    """View decorator that checks the request's query count against a budget.
+
+    The count includes queries from the ``before_request`` hooks. Going
+    over budget raises :exc:`QueryBudgetExceeded` when
+    ``QUERY_BUDGET_STRICT`` is set (the default when testing) and logs a
+    warning otherwise.
+    """
+
+    def check(view):
+        count = g.get("db_query_count", 0)
+        if count > limit:
+            message = f"{view.__name__} ran {count} queries, the budget is {limit}."
+            if current_app.config["QUERY_BUDGET_STRICT"]:
+                raise QueryBudgetExceeded(message)
+            current_app.logger.warning(message)
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+
+            @functools.wraps(view)
+            async def wrapped_async_view(**kwargs):
+                response = await view(**kwargs)
+                check(view)
+                return response
+
+            return wrapped_async_view
+
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            response = view(**kwargs)
+            check(view)
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+def explain(query, params=None):
+    """Get the SQLite query plan of a ``text()`` query, one step per item.
+
+    Queries typed with ``text().columns()`` are accepted too, their
+    parameters are bound with the same types.
+    """
+    clause = getattr(query, "element", query)
+    plan = text("EXPLAIN QUERY PLAN " + clause.text).bindparams(
+        *clause._bindparams.values()
+    )
+    rows = get_db().execute(plan, params or {})
+    return [row.detail for row in rows]
+
+def plan_problems(steps):
+    """Find the steps of a query plan that read a whole table or sort it.
+
+    A full scan or a temporary B-tree makes a query slower as the table
+    grows, even when it has a LIMIT.
+    """
+    return [
+        step
+        for step in steps
+        if "TEMP B-TREE" in step or (step.startswith("SCAN") and "USING" not in step)
+    ]
+
+def _redact(parameters):
+    """Replace bound parameter values with their type names for logging."""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.sonic_query_start = time.perf_counter()
+
+def _after_cursor_execute(slow_seconds, track_duplicates, conn, cursor, statement, parameters, context, executemany):
+    """Count the query and its time against the current request.
+
+    Duplicates are only looked for when they are reported, with
+    ``QUERY_TRACKER_HEADERS`` or while a :class:`QueryTracker` is active.
+    """
+    elapsed = time.perf_counter() - context.sonic_query_start
+
+    if has_app_context():
+        g.db_query_count = g.get("db_query_count", 0) + 1
+        g.db_query_time = g.get("db_query_time", 0) + elapsed
+        if not executemany and (track_duplicates or _trackers):
+            # The same statement with the same parameters twice is wasted work.
+            key = hash((statement, repr(parameters)))
+            seen = g.setdefault("db_query_seen", set())
+            if key in seen:
+                g.db_query_duplicates = g.get("db_query_duplicates", 0) + 1
+            else:
+                seen.add(key)
+
+    for tracker in _trackers:
+        tracker.statements.append(statement)
+
+    if elapsed >= slow_seconds:
+        logger.warning(
+            "Slow query (%.1f ms): %s %s",
+            elapsed * 1000,
+            statement,
+            "[executemany]" if executemany else _redact(parameters),
+        )
+
+def _query_headers(response):
+    """Report the request's queries in debug response headers."""
+    response.headers["X-Query-Count"] = str(g.get("db_query_count", 0))
+    response.headers["X-Query-Time-Ms"] = f"{g.get('db_query_time', 0) * 1000:.2f}"
+    response.headers["X-Query-Duplicates"] = str(g.get("db_query_duplicates", 0))
+    return response
+
+def _set_sqlite_pragmas(pragmas, dbapi_connection, connection_record):
+    """Apply the configured pragmas to every new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+def _engine_options(app):
+    """Build the engine options from the ``DB_POOL_*`` config.
+
+    Options already set in ``SQLALCHEMY_ENGINE_OPTIONS`` take precedence.
+    In-memory SQLite databases use a single shared connection, so they
+    don't get any pool settings.
+    """
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+
+    options.setdefault("pool_size", app.config["DB_POOL_SIZE"])
+    options.setdefault("max_overflow", app.config["DB_POOL_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", app.config["DB_POOL_TIMEOUT"])
+    options.setdefault("pool_recycle", app.config["DB_POOL_RECYCLE"])
+    options.setdefault("pool_pre_ping", app.config["DB_POOL_PRE_PING"])
+    return options
+
+def instrument_engine(app, engine, pragmas=None):
+    """Apply the SQLite pragmas and count and time the engine's queries.
+
+    :param pragmas: the pragmas run on every new connection, defaults to
+        ``SQLITE_PRAGMAS``
+    """
+    if pragmas is None:
+        pragmas = app.config["SQLITE_PRAGMAS"]
+    if engine.dialect.name == "sqlite":
+        set_pragmas = functools.partial(_set_sqlite_pragmas, pragmas)
+        event.listen(engine, "connect", set_pragmas)
+    after_execute = functools.partial(
+        _after_cursor_execute,
+        app.config["SLOW_QUERY_SECONDS"],
+        bool(app.config["QUERY_TRACKER_HEADERS"]),
+    )
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_execute)
+
+def init_migrate(app):
+    """Register Flask-Migrate with the Flask app.
+
+    Alembic is slow to import, so with ``STARTUP_LAZY`` this only runs
+    when the app is loaded by the ``flask`` command. Scripts that run
+    migrations themselves must call it before ``flask_migrate.upgrade``.
+    """
+    from flask_migrate import Migrate
+
+    # The models must be imported for autogenerate to see them.
+    import sonic.models  # noqa: F401
+
+    if "migrate" not in app.extensions:
+        Migrate(app, db)
+
 def init_app(app):
-    """Register SQLAlchemy and Flask-Migrate with the Flask app."""
+    """Register SQLAlchemy with the Flask app."""
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = _engine_options(app)
+    if app.config["SQLALCHEMY_READ_URI"]:
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        binds["read"] = app.config["SQLALCHEMY_READ_URI"]
     db.init_app(app)
-    migrate.init_app(app, db)
+    app.teardown_appcontext(_close_read_db)
+    if not event.contains(db.session, "after_commit", _remember_write):
+        event.listen(db.session, "after_commit", _remember_write)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(app, engine)
+
+    if app.config["QUERY_TRACKER_HEADERS"]:
+        app.after_request(_query_headers)
 
 def init_db():
     """Initialize the database only if it does not exist."""
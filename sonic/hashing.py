@@ -0,0 +1,146 @@
+import asyncio
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy import text
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from sonic.db import db
+
+
+class PasswordHasher:
+    """Hash and verify passwords according to the configured policy.
+
+    The CPU-heavy work runs in a small process pool so it doesn't hold
+    the GIL against other requests. At most ``max_pending`` operations
+    are allowed at once; beyond that callers get a fast 429 instead of
+    queueing behind the pool.
+
+    :param method: a werkzeug hashing method such as ``scrypt`` or
+        ``pbkdf2:sha256:600000``
+    :param workers: size of the process pool, ``0`` hashes inline
+    :param max_pending: concurrent hash operations allowed
+    :param retry_after: seconds clients are told to wait when saturated
+    """
+
+    def __init__(self, method="scrypt", workers=2, max_pending=8, retry_after=1):
+        self.method = method
+        self.workers = workers
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._prefix = None
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        """Get the process pool, starting it in this process on first use."""
+        if self._pool is None or self._pool_pid != os.getpid():
+            # Imported here, multiprocessing only matters once a pool starts.
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    # Spawned workers don't inherit the server's threads.
+                    context = multiprocessing.get_context("spawn")
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def _submit(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        return self._executor().submit(func, *args).result()
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise TooManyRequests(
+                "Too many logins in progress, please retry shortly.",
+                retry_after=self.retry_after,
+            )
+        try:
+            return self._submit(func, *args)
+        finally:
+            self._slots.release()
+
+    async def _run_async(self, func, *args):
+        """Run like :meth:`_run`, awaiting the pool instead of blocking."""
+        if not self._slots.acquire(blocking=False):
+            raise TooManyRequests(
+                "Too many logins in progress, please retry shortly.",
+                retry_after=self.retry_after,
+            )
+        try:
+            if not self.workers:
+                return await asyncio.to_thread(func, *args)
+            return await asyncio.wrap_future(self._executor().submit(func, *args))
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Hash a password with the configured method."""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Check a password against a stored hash."""
+        return self._run(check_password_hash, pwhash, password)
+
+    async def verify_async(self, pwhash, password):
+        """Check a password like :meth:`verify`, for async views."""
+        return await self._run_async(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Check if a stored hash was made with different parameters."""
+        if self._prefix is None:
+            # werkzeug expands the method's default parameters into the
+            # stored hash, so compare against a real hash's prefix.
+            self._prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        return pwhash.split("$", 1)[0] != self._prefix
+
+    def rehash_later(self, user_id, old_hash, password):
+        """Store a hash made with the current policy, in the background.
+
+        The update only applies if the stored hash hasn't changed in the
+        meantime.
+        """
+        app = current_app._get_current_object()
+
+        def store(new_hash):
+            with app.app_context():
+                db.session.execute(
+                    text(
+                        "UPDATE user SET password = :new"
+                        " WHERE id = :id AND password = :old"
+                    ),
+                    {"new": new_hash, "id": user_id, "old": old_hash},
+                )
+                db.session.commit()
+                app.logger.info(f"Rehashed the password of user {user_id}.")
+
+        if not self.workers:
+            threading.Thread(
+                target=lambda: store(generate_password_hash(password, self.method)),
+                daemon=True,
+            ).start()
+            return
+
+        future = self._executor().submit(generate_password_hash, password, self.method)
+        future.add_done_callback(lambda done: store(done.result()))
+
+
+def get_hasher():
+    """Get the password hasher for the current app."""
+    return current_app.extensions["sonic_hasher"]
+
+
+def init_app(app):
+    """Create the password hasher from the ``PASSWORD_HASH_*`` config."""
+    app.extensions["sonic_hasher"] = PasswordHasher(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        max_pending=app.config["PASSWORD_HASH_MAX_PENDING"],
+        retry_after=app.config["PASSWORD_HASH_RETRY_AFTER"],
+    )
@@ -0,0 +1,193 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request, template_rendered, before_render_template
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class _Shard:
+    """Metric values written by a single thread."""
+
+    __slots__ = ("counters", "gauges", "histograms")
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+
+class Registry:
+    """Counters, gauges and histograms in Prometheus text format.
+
+    Every thread writes to its own shard, so recording a value never
+    takes a lock. The shards are only merged when the metrics are
+    scraped.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def add_gauge(self, name, labels=(), value=1):
+        gauges = self._shard().gauges
+        key = (name, labels)
+        gauges[key] = gauges.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=None):
+        buckets = buckets or self.buckets
+        histograms = self._shard().histograms
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            # Per-bucket counts (the last one is +Inf), then the sum.
+            histogram = histograms[key] = [buckets, [0] * (len(buckets) + 1), 0]
+        histogram[1][bisect_left(buckets, value)] += 1
+        histogram[2] += value
+
+    def _merge(self):
+        with self._lock:
+            shards = list(self._shards)
+
+        counters, gauges, histograms = {}, {}, {}
+        for shard in shards:
+            # dict.copy() doesn't release the GIL, so the owning thread
+            # can't change the dict while it's being copied.
+            for key, value in shard.counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, value in shard.gauges.copy().items():
+                gauges[key] = gauges.get(key, 0) + value
+            for key, (buckets, counts, total) in shard.histograms.copy().items():
+                merged = histograms.get(key)
+                if merged is None:
+                    histograms[key] = [buckets, list(counts), total]
+                else:
+                    merged[1] = [a + b for a, b in zip(merged[1], counts)]
+                    merged[2] += total
+        return counters, gauges, histograms
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        counters, gauges, histograms = self._merge()
+        lines = []
+
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name, group in _by_name(values):
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in group:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+
+        for name, group in _by_name(histograms):
+            lines.append(f"# TYPE {name} histogram")
+            for labels, (buckets, counts, total) in group:
+                cumulative = 0
+                for bound, count in zip(buckets + ("+Inf",), counts):
+                    cumulative += count
+                    bucket_labels = labels + (("le", str(bound)),)
+                    lines.append(f"{name}_bucket{_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _by_name(values):
+    groups = {}
+    for (name, labels), value in sorted(values.items()):
+        groups.setdefault(name, []).append((labels, value))
+    return groups.items()
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def get_registry(app):
+    return app.extensions["sonic_metrics"]
+
+
+def init_app(app):
+    """Record request, database and template metrics and serve ``/metrics``."""
+    registry = app.extensions["sonic_metrics"] = Registry(app.config["METRICS_BUCKETS"])
+
+    def start_request():
+        g.metrics_start = time.perf_counter()
+        g.metrics_in_progress = True
+        registry.add_gauge("sonic_requests_in_progress")
+
+    # Run first, so the timing also covers the other before_request hooks.
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+
+    @app.after_request
+    def record_request(response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+
+        endpoint = request.endpoint or "none"
+        labels = (("endpoint", endpoint),)
+        registry.inc(
+            "sonic_requests_total",
+            labels + (("method", request.method), ("status", response.status_code)),
+        )
+        registry.observe(
+            "sonic_request_duration_seconds", labels, time.perf_counter() - start
+        )
+
+        queries = g.get("db_query_count", 0)
+        registry.inc("sonic_db_queries_total", labels, queries)
+        registry.inc("sonic_db_query_seconds_total", labels, g.get("db_query_time", 0))
+        registry.observe("sonic_db_queries_per_request", labels, queries, QUERY_BUCKETS)
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        if g.pop("metrics_in_progress", False):
+            registry.add_gauge("sonic_requests_in_progress", value=-1)
+
+    def start_render(sender, template, context, **extra):
+        g.setdefault("metrics_renders", []).append(time.perf_counter())
+
+    def end_render(sender, template, context, **extra):
+        starts = g.get("metrics_renders")
+        if starts:
+            registry.observe(
+                "sonic_template_render_seconds",
+                (("template", template.name),),
+                time.perf_counter() - starts.pop(),
+            )
+
+    before_render_template.connect(start_render, app, weak=False)
+    template_rendered.connect(end_render, app, weak=False)
+
+    if app.config["METRICS_ENABLED"]:
+
+        @app.route("/metrics")
+        def metrics():
+            return registry.render(), {
+                "Content-Type": "text/plain; version=0.0.4; charset=utf-8"
+            }
@@ -21,9 +21,61 @@ class Post(db.Model):
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    created = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+    # Copy of the author's username, kept in sync by triggers
+    author_username = db.Column(db.String, server_default='', nullable=False)
+    # In the format SQLAlchemy binds DateTime, which the page cursors compare
+    created = db.Column(
+        db.DateTime,
+        server_default=db.text("(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"),
+        nullable=False,
+    )
     title = db.Column(db.String, nullable=False)
     body = db.Column(db.Text, nullable=False)
 
     # Define relationship to User
     author = db.relationship('User', back_populates='posts')
+
+    __table_args__ = (
+        # Keyset pagination index for the post feed
+        db.Index('ix_post_created_id', 'created', 'id'),
+        # Posts by author, newest first
+        db.Index('ix_post_author_id_created', 'author_id', 'created', 'id'),
+    )
+
+class Job(db.Model):
+    __tablename__ = 'job'  # Background jobs, see sonic.tasks
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), server_default='pending', nullable=False)
+    attempts = db.Column(db.Integer, server_default='0', nullable=False)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+
+    __table_args__ = (
+        # The runners look for pending jobs that are due
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+class StoredSession(db.Model):
+    __tablename__ = 'session'  # Server-side sessions, see sonic.sessions
+
+    # SHA-256 of the token in the cookie
+    id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer)
+    data = db.Column(db.Text, nullable=False)
+    # The user's id and username, so requests don't load them
+    identity = db.Column(db.Text)
+    # Unix time
+    expires = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        # Revoking a user's sessions
+        db.Index('ix_session_user_id', 'user_id'),
+        # The expiry sweep
+        db.Index('ix_session_expires', 'expires'),
+    )
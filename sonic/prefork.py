@@ -0,0 +1,284 @@
+"""Serve the app from several pre-forked waitress processes::
+
+    python -m sonic.prefork --port 5000 --workers 4
+
+The app is created and warmed up once, then each worker is forked from
+it and shares its memory copy-on-write. The workers accept connections
+from one listening socket. A worker that has served ``--max-requests``
+requests stops accepting, finishes its requests and exits, and is
+replaced by a fresh fork.
+
+Caches that live in the process stay consistent: deletes and clears are
+passed on to the other workers, see :func:`sonic.cache.share_invalidations`.
+Rate limits and metrics are still counted by each worker, use
+``RATELIMIT_STORE = "sonic.ratelimit.sqlite_store"`` to share the limits.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+from waitress import wasyncore
+from waitress.channel import HTTPChannel
+from waitress.server import create_server
+
+from sonic import cache, create_app, requestlog
+from sonic.db import db
+
+logger = logging.getLogger("sonic.prefork")
+
+_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
+
+class _Worker:
+    """Run the app in a forked process until asked to retire."""
+
+    def __init__(self, app, sock, threads, max_requests, graceful_timeout, ident):
+        self.app = app
+        self.graceful_timeout = graceful_timeout
+        self.max_requests = max_requests
+        self.served = 0
+        self.retire = threading.Event()
+        self.server = create_server(
+            self.count, sockets=[sock], threads=threads, ident=ident
+        )
+
+    def count(self, environ, start_response):
+        self.served += 1
+        if self.max_requests and self.served >= self.max_requests:
+            self.retire.set()
+        return self.app(environ, start_response)
+
+    def _idle(self):
+        """Whether no request is being read, run or sent."""
+        dispatcher = self.server.task_dispatcher
+        if dispatcher.active_count or dispatcher.queue:
+            return False
+        now = time.time()
+        for channel in list(self.server._map.values()):
+            if not isinstance(channel, HTTPChannel):
+                continue
+            if channel.requests or channel.request or channel.total_outbufs_len:
+                return False
+            # Connections accepted just before may not have sent a request yet
+            if now - channel.last_activity < 0.5:
+                return False
+        return True
+
+    def _drain(self):
+        self.retire.wait()
+        server = self.server
+        # Let the other workers accept the new connections
+        server.trigger.pull_trigger(lambda: setattr(server, "accepting", False))
+        deadline = time.monotonic() + self.graceful_timeout
+        while not self._idle() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # The loop returns once its map is empty
+        server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.retire.set())
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+        threading.Thread(target=self._drain, daemon=True).start()
+        self.server.run()
+        self.server.task_dispatcher.shutdown(timeout=self.graceful_timeout)
+
+
+class Arbiter:
+    """Fork the workers and replace the ones that exit.
+
+    :param app: the warmed up app the workers are forked from
+    :param sock: the bound, listening socket
+    :param workers: number of worker processes
+    :param threads: waitress threads in each worker
+    :param max_requests: requests a worker serves before it is replaced,
+        ``0`` to keep workers forever
+    :param max_requests_jitter: up to this many requests are added to
+        each worker's limit, so they are not all replaced at once
+    :param graceful_timeout: seconds a retiring worker gets to finish
+    """
+
+    def __init__(
+        self,
+        app,
+        sock,
+        workers,
+        threads=4,
+        max_requests=0,
+        max_requests_jitter=0,
+        graceful_timeout=30,
+        ident="waitress",
+    ):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.ident = ident
+        self.pids = set()
+        self.stopping = False
+
+    def spawn(self):
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            max_requests += random.randint(0, self.max_requests_jitter)
+        # Until the worker has its own handlers, the signals are held back
+        signal.pthread_sigmask(signal.SIG_BLOCK, _SIGNALS)
+        # Forking with other threads running can deadlock the child
+        requestlog.stop_listener()
+        pid = os.fork()
+        if pid:
+            requestlog.start_listener(self.app)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+            self.pids.add(pid)
+            return
+
+        status = 0
+        try:
+            self.pids.clear()
+            random.seed()
+            # Connections can't be shared with the parent or the other workers
+            with self.app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose(close=False)
+            requestlog.start_listener(self.app)
+            _Worker(
+                self.app,
+                self.sock,
+                self.threads,
+                max_requests,
+                self.graceful_timeout,
+                self.ident,
+            ).run()
+        except BaseException:
+            logger.exception("Worker failed.")
+            status = 1
+        finally:
+            # os._exit skips the atexit hooks
+            requestlog.stop_listener()
+            logging.shutdown()
+            os._exit(status)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        logger.info(
+            f"Serving on {self.sock.getsockname()} with {self.workers} workers"
+            f" of {self.threads} threads."
+        )
+
+        stopped_at = None
+        while self.pids:
+            if self.stopping and stopped_at is None:
+                stopped_at = time.monotonic()
+            if stopped_at and time.monotonic() - stopped_at > self.graceful_timeout:
+                for pid in self.pids:
+                    os.kill(pid, signal.SIGKILL)
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                time.sleep(0.1)
+                continue
+            self.pids.discard(pid)
+            if not self.stopping:
+                code = os.waitstatus_to_exitcode(status)
+                if code:
+                    logger.warning(f"Worker {pid} exited with {code}.")
+                    # Don't fork in a tight loop if workers can't start
+                    time.sleep(1)
+                self.spawn()
+
+
+def cpu_count():
+    """Count the CPUs this process may run on, which can be fewer than the
+    machine has, for example in a container limited with ``--cpuset-cpus``.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def serve(
+    app=None,
+    host="0.0.0.0",
+    port=8080,
+    workers=None,
+    backlog=1024,
+    **kwargs,
+):
+    """Serve an app from pre-forked workers until stopped by a signal.
+
+    The app is created with :func:`sonic.create_app` if not given. Other
+    arguments are passed to :class:`Arbiter`.
+
+    :param workers: defaults to :func:`cpu_count`
+    """
+    if app is None:
+        app = create_app()
+    workers = workers or cpu_count()
+    if workers > 1 and app.config["RATELIMIT_STORE"] is None:
+        logger.info(
+            "Rate limits are counted by each worker, set RATELIMIT_STORE to"
+            " share them."
+        )
+    cache.share_invalidations(app)
+
+    sock = socket.create_server((host, port), backlog=backlog)
+    sock.setblocking(False)
+    # Keep what was loaded so far out of the collector, so collections in
+    # the workers don't touch, and copy, the shared pages.
+    gc.collect()
+    gc.freeze()
+    try:
+        Arbiter(app, sock, workers, **kwargs).run()
+    finally:
+        sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", 0))
+    )
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--max-requests", type=int, default=0)
+    parser.add_argument("--max-requests-jitter", type=int, default=0)
+    parser.add_argument("--graceful-timeout", type=float, default=30)
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument("--ident", default="waitress")
+    args = parser.parse_args()
+    serve(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        backlog=args.backlog,
+        threads=args.threads,
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        graceful_timeout=args.graceful_timeout,
+        ident=args.ident,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import import_string
+
+
+class MemoryBucketStore:
+    """Token buckets kept in this process, for a single server process.
+
+    Any object with the same ``take`` method can be configured in its
+    place with ``RATELIMIT_STORE``, see :class:`SQLiteBucketStore`.
+
+    :param maxsize: buckets kept, the least recently used are dropped
+    """
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, cost=1):
+        """Take ``cost`` tokens from a bucket if it has enough.
+
+        A bucket holds up to ``burst`` tokens and gains ``rate`` tokens
+        per second. Buckets start full.
+
+        :return: ``0`` if the tokens were taken, otherwise the seconds
+            until the bucket will have enough
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return 0 if allowed else (cost - tokens) / rate
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file, shared by every process using it.
+
+    Each :meth:`take` is a single atomic upsert, so server processes on
+    the same machine enforce one limit between them. Buckets that have
+    been idle for ``ttl`` seconds are deleted now and then.
+
+    :param path: database file, created if needed
+    :param ttl: seconds after which an idle bucket is forgotten, should
+        be longer than the time any limit takes to refill
+    """
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._calls = 0
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            # Connections can't be shared with forked children.
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY,"
+                " tokens REAL NOT NULL, updated REAL NOT NULL, allowed INTEGER)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, cost=1):
+        """Take tokens like :meth:`MemoryBucketStore.take`."""
+        now = time.time()
+        conn = self._connect()
+        # Every SET expression reads the old row, so they agree on refilled.
+        refilled = "min(:burst, tokens + (:now - updated) * :rate)"
+        tokens, allowed = conn.execute(
+            "INSERT INTO bucket (key, tokens, updated, allowed)"
+            " VALUES (:key, :burst - :cost, :now, :burst >= :cost)"
+            " ON CONFLICT (key) DO UPDATE SET"
+            f" tokens = CASE WHEN {refilled} >= :cost"
+            f" THEN {refilled} - :cost ELSE {refilled} END,"
+            f" allowed = {refilled} >= :cost, updated = :now"
+            " RETURNING tokens, allowed",
+            {"key": str(key), "rate": rate, "burst": burst, "cost": cost, "now": now},
+        ).fetchone()
+
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            conn.execute("DELETE FROM bucket WHERE updated < ?", (now - self.ttl,))
+        return 0 if allowed else (cost - tokens) / rate
+
+
+def sqlite_store(app):
+    """Create a :class:`SQLiteBucketStore` in the instance folder.
+
+    Set ``RATELIMIT_STORE = "sonic.ratelimit.sqlite_store"`` to share the
+    limits between the server processes of one machine.
+    """
+    return SQLiteBucketStore(os.path.join(app.instance_path, "ratelimit.sqlite"))
+
+
+class RateLimiter:
+    """Reject requests over their rate limits and shed load when busy.
+
+    Limits are ``(requests, seconds)`` token buckets: up to ``requests``
+    at once, refilled at ``requests / seconds`` per second.
+
+    ``RATELIMIT_PER_IP``
+        for every client address, see :func:`init_app` for proxies
+    ``RATELIMIT_PER_USER``
+        for every logged in user, on top of the address limit
+    ``RATELIMIT_ROUTES``
+        by endpoint, or ``"METHOD endpoint"`` to limit one method only,
+        for every user or, when logged out, every address
+
+    Requests over a limit get a 429. At most ``RATELIMIT_MAX_IN_FLIGHT``
+    requests are handled at once by a process, others get a 503 right
+    away instead of waiting for a thread.
+    """
+
+    def __init__(self, app):
+        self.enabled = app.config["RATELIMIT_ENABLED"]
+        self.per_ip = app.config["RATELIMIT_PER_IP"]
+        self.per_user = app.config["RATELIMIT_PER_USER"]
+        self.routes = app.config["RATELIMIT_ROUTES"]
+        self.exempt = set(app.config["RATELIMIT_EXEMPT"])
+        self.retry_after = app.config["RATELIMIT_RETRY_AFTER"]
+        max_in_flight = app.config["RATELIMIT_MAX_IN_FLIGHT"]
+        self._slots = max_in_flight and threading.BoundedSemaphore(max_in_flight)
+
+        store = app.config["RATELIMIT_STORE"]
+        if store is None:
+            store = MemoryBucketStore()
+        elif isinstance(store, str):
+            store = import_string(store)(app)
+        self.store = store
+
+    def _take(self, key, limit):
+        requests, seconds = limit
+        wait = self.store.take(key, requests / seconds, requests)
+        if wait:
+            raise TooManyRequests(
+                "Too many requests, please slow down.", retry_after=math.ceil(wait)
+            )
+
+    def admit(self):
+        """Check the current request against the limits, before the view."""
+        if request.endpoint in self.exempt:
+            return
+
+        if self._slots:
+            if not self._slots.acquire(blocking=False):
+                raise ServiceUnavailable(
+                    "The server is busy, please retry shortly.",
+                    retry_after=self.retry_after,
+                )
+            g.ratelimit_slot = True
+
+        if not self.enabled:
+            return
+        ip = request.remote_addr
+        user_id = g.user["id"] if g.get("user") else None
+        if self.per_ip:
+            self._take(("ip", ip), self.per_ip)
+        if self.per_user and user_id is not None:
+            self._take(("user", user_id), self.per_user)
+
+        limit = self.routes.get(f"{request.method} {request.endpoint}")
+        if limit is None:
+            limit = self.routes.get(request.endpoint)
+        if limit:
+            client = ("user", user_id) if user_id is not None else ("ip", ip)
+            self._take(("route", request.endpoint, *client), limit)
+
+    def release(self, exc=None):
+        if g.pop("ratelimit_slot", False):
+            self._slots.release()
+
+
+def init_app(app):
+    """Check every request with the ``RATELIMIT_*`` limits.
+
+    Runs after the other ``before_request`` hooks, so the user is known
+    and rejected requests still show up in the logs and metrics.
+
+    Behind proxies, set ``RATELIMIT_PROXY_HOPS`` to their number. The
+    client address is then taken from the ``X-Forwarded-For`` entry the
+    outermost proxy added, the entries before it are sent by the client
+    and can't be trusted.
+    """
+    hops = app.config["RATELIMIT_PROXY_HOPS"]
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops)
+    limiter = app.extensions["sonic_ratelimit"] = RateLimiter(app)
+    app.before_request(limiter.admit)
+    app.teardown_request(limiter.release)
@@ -0,0 +1,169 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, request
+
+logger = logging.getLogger("sonic.request")
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+class JSONFormatter(logging.Formatter):
+    """Format a request log record as one line of JSON."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+        }
+        entry.update(
+            getattr(record, "request", None) or {"message": record.getMessage()}
+        )
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue records without ever blocking the request thread.
+
+    Records are handed over as is and formatted by the listener thread.
+    When the queue is full the record is dropped and counted instead.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def start_listener(app):
+    """Start the listener thread that writes queued records, once per process."""
+    global _listener, _listener_pid
+
+    with _listener_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            return
+        # A forked child inherits the handler but not the listener thread.
+        log_queue = queue.Queue(app.config["REQUEST_LOG_QUEUE_SIZE"])
+        handler = logging.StreamHandler()
+        handler.setFormatter(JSONFormatter())
+        _listener = QueueListener(log_queue, handler)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+        for old in list(logger.handlers):
+            logger.removeHandler(old)
+        logger.addHandler(DroppingQueueHandler(log_queue))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def stop_listener():
+    """Write the queued records and stop the listener thread.
+
+    :func:`start_listener` starts a new one, call it after forking.
+    """
+    global _listener_pid
+
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener_pid = None
+
+
+def _reset_lock():
+    # The lock may have been held by another thread at the fork.
+    global _listener_lock
+    _listener_lock = threading.Lock()
+
+
+atexit.register(stop_listener)
+os.register_at_fork(after_in_child=_reset_lock)
+
+
+def _sample_rate(app, endpoint):
+    return app.config["REQUEST_LOG_SAMPLE_RATES"].get(
+        endpoint, app.config["REQUEST_LOG_SAMPLE_RATE"]
+    )
+
+
+def _request_body(app):
+    """Get the request body if capturing is enabled for its content type."""
+    limit = app.config["REQUEST_LOG_BODY_MAX"]
+    if not limit or request.mimetype not in app.config["REQUEST_LOG_BODY_TYPES"]:
+        return None
+    if request.content_length is None or request.content_length > limit:
+        return None
+    return request.get_data(as_text=True)
+
+
+def init_app(app):
+    """Log every sampled request as a structured JSON line.
+
+    Records go through a bounded queue to a listener thread, so writing
+    the log never blocks the request.
+    """
+    start_listener(app)
+
+    def start_timer():
+        g.request_start_ns = time.perf_counter_ns()
+
+    # Run first, so the timing also covers the other before_request hooks.
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+
+    @app.after_request
+    def log_request(response):
+        if request.path == "/favicon.ico":
+            return response
+        if _listener_pid != os.getpid():
+            # Forked, by sonic.prefork or another pre-forking server
+            start_listener(app)
+
+        # Server errors are always logged, everything else is sampled.
+        rate = _sample_rate(app, request.endpoint)
+        if response.status_code < 500 and (rate <= 0 or random.random() >= rate):
+            return response
+
+        start = g.get("request_start_ns")
+        duration = None
+        if start is not None:
+            duration = (time.perf_counter_ns() - start) / 1_000_000
+
+        entry = {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "duration_ms": duration,
+            "ip": request.remote_addr,
+            "host": request.host.split(":", 1)[0],
+            "params": request.args.to_dict(),
+            "headers": {
+                name: request.headers[name]
+                for name in app.config["REQUEST_LOG_HEADERS"]
+                if name in request.headers
+            },
+        }
+        body = _request_body(app)
+        if body is not None:
+            entry["body"] = body
+
+        level = logging.ERROR if response.status_code >= 500 else logging.INFO
+        logger.log(level, "request", extra={"request": entry})
+        return response
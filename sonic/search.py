@@ -0,0 +1,119 @@
+import secrets
+
+from flask import Blueprint, render_template, request, current_app as app
+from markupsafe import Markup, escape
+from sqlalchemy import DateTime, text
+
+from sonic.db import get_read_db, query_budget
+
+bp = Blueprint("search", __name__)
+
+
+def _markers():
+    """Make placeholders for the highlight tags, used until the text has
+    been escaped. Posts can contain any text, even control characters, so
+    a random token keeps them from planting tags."""
+    token = secrets.token_hex(8)
+    return f"\x02{token}", f"{token}\x03"
+
+
+def build_match_query(terms):
+    """Turn free text into an FTS5 query matching every word.
+
+    Each word is quoted so FTS5 operators typed by users are searched
+    for literally, and the last word matches as a prefix so results
+    show up while the user is still typing.
+    """
+    words = terms.split()
+    if not words:
+        return None
+    quoted = ['"' + word.replace('"', '""') + '"' for word in words]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def highlight(fragment, start, end):
+    """Escape a snippet from FTS5 and turn its markers into ``<mark>``.
+
+    The control characters used by the markers are dropped from the rest
+    of the text.
+    """
+    return (
+        escape(fragment)
+        .replace(start, Markup("<mark>"))
+        .replace(end, Markup("</mark>"))
+        .replace("\x02", "")
+        .replace("\x03", "")
+    )
+
+
+def search_posts(terms, page=1, per_page=20):
+    """Find posts matching the search terms, best match first.
+
+    Results are ranked with bm25, weighting title matches above body
+    matches.
+
+    :param terms: the text the user searched for
+    :param page: 1-based page number
+    :param per_page: number of results per page
+    :return: tuple of ``(results, has_next)``
+    """
+    match = build_match_query(terms)
+    if match is None:
+        return [], False
+    start, end = _markers()
+
+    rows = (
+        get_read_db()
+        .execute(
+            text(
+                "SELECT p.id, p.created, p.author_id, p.author_username AS username,"
+                " highlight(post_fts, 0, :start, :end) AS title,"
+                " snippet(post_fts, 1, :start, :end, '…', 24) AS snippet"
+                " FROM post_fts"
+                " JOIN post p ON p.id = post_fts.rowid"
+                " WHERE post_fts MATCH :match"
+                " ORDER BY bm25(post_fts, 10.0, 1.0)"
+                " LIMIT :limit OFFSET :offset"
+            ).columns(created=DateTime),
+            {
+                "start": start,
+                "end": end,
+                "match": match,
+                "limit": per_page + 1,
+                "offset": (page - 1) * per_page,
+            },
+        )
+        .mappings()
+        .fetchall()
+    )
+
+    results = [
+        {
+            "id": row["id"],
+            "created": row["created"],
+            "author_id": row["author_id"],
+            "username": row["username"],
+            "title": highlight(row["title"], start, end),
+            "snippet": highlight(row["snippet"], start, end),
+        }
+        for row in rows[:per_page]
+    ]
+    return results, len(rows) > per_page
+
+
+@bp.route("/search")
+@query_budget(2)
+def search():
+    """Search the title and body of every post."""
+    terms = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    results, has_next = search_posts(terms, page, app.config["SEARCH_PER_PAGE"])
+    app.logger.info(f"Search for '{terms}' returned {len(results)} results.")
+    return render_template(
+        "search/results.html",
+        terms=terms,
+        results=results,
+        page=page,
+        has_next=has_next,
+    )
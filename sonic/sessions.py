@@ -0,0 +1,339 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+
+from flask import session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import text
+from werkzeug.datastructures import CallbackDict
+from werkzeug.utils import import_string
+
+from sonic.cache import get_cache
+from sonic.db import db
+
+# The same format as Flask's cookie sessions, so flashed messages and
+# other tagged values round-trip
+serializer = TaggedJSONSerializer()
+
+_LOAD = text(
+    "SELECT data, identity, expires FROM session WHERE id = :id AND expires > :now"
+)
+_SAVE = text(
+    "INSERT INTO session (id, user_id, data, identity, expires)"
+    " VALUES (:id, :user_id, :data, :identity, :expires)"
+    " ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id,"
+    " data = excluded.data, identity = excluded.identity,"
+    " expires = excluded.expires"
+)
+
+
+def _key(token):
+    # Only a hash of the cookie is stored, a leaked table can't log anyone in
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """A session whose data is kept on the server.
+
+    :param token: the id sent in the cookie, ``None`` for a new session
+    :param identity: the user identity stored with the session, see
+        :func:`session_identity`
+    :param expires: Unix time the stored session expires
+    """
+
+    modified = False
+    accessed = False
+
+    def __init__(self, initial=None, token=None, identity=None, expires=0):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.token = token
+        self.identity = identity
+        self.expires = expires
+        self.loaded_user_id = dict.get(self, "user_id")
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class SQLiteSessionStore:
+    """Sessions in the ``session`` table, the recently used ones also in
+    the ``session`` cache.
+
+    Expired sessions are deleted by a background thread every
+    ``SESSION_SWEEP_INTERVAL`` seconds, started in each process with its
+    first request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sweep_interval = app.config["SESSION_SWEEP_INTERVAL"]
+        self._sweeper_pid = None
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        """Get a stored session.
+
+        :return: tuple of ``(data, identity, expires)`` with ``data`` and
+            ``identity`` serialized, or ``None`` if there is no such
+            session or it expired
+        """
+        now = int(time.time())
+        cache = get_cache("session")
+        record = cache.get(key)
+        if record is None:
+            with db.engine.connect() as conn:
+                row = conn.execute(_LOAD, {"id": key, "now": now}).fetchone()
+            if row is None:
+                return None
+            record = tuple(row)
+            cache.set(key, record)
+        return record if record[2] > now else None
+
+    def save(self, key, user_id, data, identity, expires):
+        with db.engine.begin() as conn:
+            conn.execute(
+                _SAVE,
+                {
+                    "id": key,
+                    "user_id": user_id,
+                    "data": data,
+                    "identity": identity,
+                    "expires": expires,
+                },
+            )
+        get_cache("session").set(key, (data, identity, expires))
+
+    def delete(self, key):
+        with db.engine.begin() as conn:
+            conn.execute(text("DELETE FROM session WHERE id = :id"), {"id": key})
+        get_cache("session").delete(key)
+
+    def revoke_user(self, user_id):
+        """Delete every session of a user, logging them out everywhere.
+
+        :return: the number of sessions deleted
+        """
+        with db.engine.begin() as conn:
+            keys = (
+                conn.execute(
+                    text("DELETE FROM session WHERE user_id = :user_id RETURNING id"),
+                    {"user_id": user_id},
+                )
+                .scalars()
+                .all()
+            )
+        cache = get_cache("session")
+        for key in keys:
+            cache.delete(key)
+        return len(keys)
+
+    def forget_user(self, user_id):
+        """Drop the identity stored with a user's sessions, so the next
+        request loads it again.
+
+        :return: the number of sessions changed
+        """
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    "UPDATE session SET identity = NULL"
+                    " WHERE user_id = :user_id AND identity IS NOT NULL"
+                    " RETURNING id, data, expires"
+                ),
+                {"user_id": user_id},
+            ).fetchall()
+        cache = get_cache("session")
+        for key, data, expires in rows:
+            # Other processes drop the session, this one keeps it without
+            # the identity so the next request doesn't load it again.
+            cache.delete(key)
+            cache.set(key, (data, None, expires))
+        return len(rows)
+
+    def sweep(self):
+        """Delete the expired sessions.
+
+        :return: the number of sessions deleted
+        """
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                text("DELETE FROM session WHERE expires <= :now"),
+                {"now": int(time.time())},
+            )
+        return result.rowcount
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                with self.app.app_context():
+                    deleted = self.sweep()
+                if deleted:
+                    self.app.logger.info(f"Deleted {deleted} expired sessions.")
+            except Exception:
+                self.app.logger.exception("Session sweep failed.")
+
+    def start(self):
+        """Start the sweeper thread in this process, if it isn't running."""
+        if self._sweeper_pid == os.getpid() or not self.sweep_interval:
+            return
+        with self._lock:
+            if self._sweeper_pid != os.getpid():
+                threading.Thread(
+                    target=self._sweep_forever,
+                    name="sonic-session-sweeper",
+                    daemon=True,
+                ).start()
+                self._sweeper_pid = os.getpid()
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keep sessions on the server, the cookie only holds a random token.
+
+    Stored sessions are written only when they change or when less than
+    half of ``PERMANENT_SESSION_LIFETIME`` is left, not on every request.
+    The token changes when the logged in user does, and emptying the
+    session deletes it from the store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        self.store.start()
+        token = request.cookies.get(self.get_cookie_name(app))
+        if token:
+            record = self.store.load(_key(token))
+            if record is not None:
+                data, identity, expires = record
+                return ServerSession(
+                    serializer.loads(data),
+                    token=token,
+                    identity=serializer.loads(identity) if identity else None,
+                    expires=expires,
+                )
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.token is not None:
+                self.store.delete(_key(session.token))
+                response.delete_cookie(
+                    name,
+                    domain=domain,
+                    path=path,
+                    secure=secure,
+                    samesite=samesite,
+                    httponly=httponly,
+                )
+                response.vary.add("Cookie")
+            return
+
+        user_id = dict.get(session, "user_id")
+        if session.token is not None and user_id != session.loaded_user_id:
+            # A new token on login and logout, against session fixation
+            self.store.delete(_key(session.token))
+            session.token = None
+        if session.identity is not None and session.identity.get("id") != user_id:
+            session.identity = None
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        refresh = session.expires - now < lifetime / 2
+        if session.token is not None and not session.modified and not refresh:
+            return
+
+        new = session.token is None
+        if new:
+            session.token = secrets.token_urlsafe(32)
+        identity = session.identity
+        self.store.save(
+            _key(session.token),
+            user_id,
+            serializer.dumps(dict(session)),
+            serializer.dumps(identity) if identity is not None else None,
+            int(now + lifetime),
+        )
+        if new or refresh:
+            response.set_cookie(
+                name,
+                session.token,
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
+            response.vary.add("Cookie")
+
+
+def session_identity(user_id):
+    """Get the identity of ``user_id`` stored with the current session.
+
+    :return: the identity, or ``None`` with cookie sessions or if none
+        was stored for this user
+    """
+    identity = getattr(session, "identity", None)
+    if identity is not None and identity.get("id") == user_id:
+        return identity
+    return None
+
+
+def remember_identity(identity):
+    """Store a user identity with the current server-side session, so the
+    next requests don't load it."""
+    current = session._get_current_object()
+    if not isinstance(current, ServerSession) or identity is None:
+        return
+    if current.identity != identity and dict.get(current, "user_id") == identity["id"]:
+        current.identity = identity
+        current.modified = True
+
+
+def get_store(app):
+    """Get the server-side session store, ``None`` with cookie sessions."""
+    return getattr(app.session_interface, "store", None)
+
+
+def init_app(app):
+    """Set up the ``SESSION_BACKEND`` sessions.
+
+    ``"cookie"`` keeps Flask's signed cookie sessions, ``"sqlite"`` uses
+    :class:`SQLiteSessionStore`. Any other value is an import path to a
+    store class or factory, called with the app.
+    """
+    backend = app.config["SESSION_BACKEND"]
+    if backend == "cookie":
+        return
+    if backend == "sqlite":
+        store = SQLiteSessionStore(app)
+    else:
+        store = import_string(backend)(app)
+    app.session_interface = ServerSessionInterface(store)
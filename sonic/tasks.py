@@ -0,0 +1,310 @@
+import json
+import os
+import threading
+import time
+import traceback
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app
+from sqlalchemy import event, text
+
+from sonic.db import db, get_db
+
+# Task functions by name, see task().
+_tasks = {}
+
+
+def task(name, max_attempts=None):
+    """Register a function as a background task.
+
+    The function is called with the keyword arguments given to
+    :func:`enqueue`, inside an app context. It is retried with backoff
+    when it raises, so it must be safe to run more than once.
+
+    :param name: name used to enqueue the task
+    :param max_attempts: runs before giving up, default ``TASK_MAX_ATTEMPTS``
+    """
+
+    def decorator(func):
+        _tasks[name] = (func, max_attempts)
+        return func
+
+    return decorator
+
+
+def enqueue(name, **kwargs):
+    """Add a job to the job table in the current transaction.
+
+    The job only exists if the transaction commits, and it is handed to
+    the workers after the commit, so it never runs against data the
+    request rolled back.
+
+    :param name: name of a task registered with :func:`task`
+    :param kwargs: JSON serializable arguments for the task
+    :return: the id of the job
+    """
+    _, max_attempts = _tasks[name]
+    session = get_db()
+    result = session.execute(
+        text(
+            "INSERT INTO job (name, payload, max_attempts)"
+            " VALUES (:name, :payload, :max_attempts)"
+        ),
+        {
+            "name": name,
+            "payload": json.dumps(kwargs),
+            "max_attempts": max_attempts or current_app.config["TASK_MAX_ATTEMPTS"],
+        },
+    )
+    session.info.setdefault("sonic_jobs", []).append(result.lastrowid)
+    return result.lastrowid
+
+
+def _dispatch_jobs(session):
+    """Hand the jobs enqueued in a committed transaction to the runner."""
+    ids = session.info.pop("sonic_jobs", None)
+    if ids:
+        current_app.extensions["sonic_jobs"].dispatch(ids)
+
+
+def _forget_jobs(session):
+    session.info.pop("sonic_jobs", None)
+
+
+class JobRunner:
+    """Run jobs from the job table.
+
+    ``TASK_MODE`` decides where enqueued jobs run:
+
+    ``thread``
+        in a thread pool of this process, with a poller thread that
+        retries failed jobs and picks up jobs left over by a crash
+    ``worker``
+        only in ``flask sonic worker`` processes
+    ``eager``
+        straight after the commit, in the request, for tests
+
+    Jobs are claimed with an atomic UPDATE, so any number of processes
+    can run jobs from the same table.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.mode = app.config["TASK_MODE"]
+        self.workers = app.config["TASK_WORKERS"]
+        self.poll_interval = app.config["TASK_POLL_INTERVAL"]
+        self.retry_delay = app.config["TASK_RETRY_DELAY"]
+        self.timeout = app.config["TASK_TIMEOUT"]
+        self._pool = None
+        self._pool_pid = None
+        self._poller_pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        """Get the thread pool, starting it in this process."""
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(
+                        self.workers, thread_name_prefix="sonic-job"
+                    )
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def start(self):
+        """Start the poller in this process, in ``thread`` mode.
+
+        The poller only reads the job table until there is a job to run,
+        the thread pool is started for the first job.
+        """
+        if self.mode != "thread" or self._poller_pid == os.getpid():
+            return
+        with self._lock:
+            if self._poller_pid != os.getpid():
+                threading.Thread(
+                    target=self._poll, name="sonic-job-poller", daemon=True
+                ).start()
+                self._poller_pid = os.getpid()
+
+    def _submit(self, id):
+        future = self._executor().submit(self.run_job, id)
+        future.add_done_callback(self._log_error)
+
+    def _log_error(self, future):
+        if future.exception() is not None:
+            self.app.logger.error(f"Running a job failed: {future.exception()!r}")
+
+    def dispatch(self, ids):
+        """Run newly committed jobs according to ``TASK_MODE``."""
+        if self.mode == "thread":
+            for id in ids:
+                self._submit(id)
+        elif self.mode == "eager":
+            for id in ids:
+                self.run_job(id)
+
+    def _poll(self):
+        failing = False
+        while True:
+            try:
+                for id in self.due_jobs():
+                    self._submit(id)
+            except Exception:
+                # Once, not every interval, for example until the job
+                # table is migrated
+                if not failing:
+                    self.app.logger.exception("Polling for jobs failed.")
+                failing = True
+            else:
+                if failing:
+                    self.app.logger.info("Polling for jobs works again.")
+                failing = False
+            time.sleep(self.poll_interval)
+
+    def due_jobs(self, limit=100):
+        """Get the ids of the jobs ready to run.
+
+        Jobs that have been running for longer than ``TASK_TIMEOUT``
+        belonged to a process that died, they are made ready again. Only
+        reads when there are no such jobs.
+        """
+        stale = " WHERE status = 'running' AND locked_at < datetime('now', :timeout)"
+        timeout = {"timeout": f"-{self.timeout} seconds"}
+        with self.app.app_context():
+            session = db.session
+            if session.execute(
+                text(f"SELECT EXISTS (SELECT 1 FROM job{stale})"), timeout
+            ).scalar():
+                session.execute(
+                    text(f"UPDATE job SET status = 'pending', locked_at = NULL{stale}"),
+                    timeout,
+                )
+                session.commit()
+            return (
+                session.execute(
+                    text(
+                        "SELECT id FROM job WHERE status = 'pending'"
+                        " AND run_at <= datetime('now') ORDER BY run_at, id LIMIT :limit"
+                    ),
+                    {"limit": limit},
+                )
+                .scalars()
+                .all()
+            )
+
+    def run_job(self, id):
+        """Claim a job and run it.
+
+        :return: ``False`` if the job wasn't ready or was claimed by
+            someone else, ``True`` otherwise
+        """
+        with self.app.app_context():
+            session = db.session
+            job = (
+                session.execute(
+                    text(
+                        "UPDATE job SET status = 'running', locked_at = datetime('now'),"
+                        " attempts = attempts + 1"
+                        " WHERE id = :id AND status = 'pending'"
+                        " AND run_at <= datetime('now')"
+                        " RETURNING name, payload, attempts, max_attempts"
+                    ),
+                    {"id": id},
+                )
+                .mappings()
+                .fetchone()
+            )
+            session.commit()
+            if job is None:
+                return False
+
+            started = time.perf_counter()
+            try:
+                func, _ = _tasks[job["name"]]
+                func(**json.loads(job["payload"]))
+            except Exception:
+                session.rollback()
+                self._failed(session, id, job, traceback.format_exc())
+            else:
+                session.execute(text("DELETE FROM job WHERE id = :id"), {"id": id})
+                session.commit()
+                self.app.logger.info(
+                    f"Job {id} ({job['name']}) done in"
+                    f" {(time.perf_counter() - started) * 1000:.0f} ms."
+                )
+            return True
+
+    def _failed(self, session, id, job, error):
+        """Schedule a retry with exponential backoff, or give up."""
+        delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+        session.execute(
+            text(
+                "UPDATE job SET locked_at = NULL, last_error = :error,"
+                " status = CASE WHEN attempts >= max_attempts"
+                " THEN 'failed' ELSE 'pending' END,"
+                " run_at = datetime('now', :delay) WHERE id = :id"
+            ),
+            {"id": id, "error": error, "delay": f"+{delay} seconds"},
+        )
+        session.commit()
+        if job["attempts"] >= job["max_attempts"]:
+            self.app.logger.error(
+                f"Job {id} ({job['name']}) failed {job['attempts']} times,"
+                f" giving up: {error}"
+            )
+        else:
+            self.app.logger.warning(
+                f"Job {id} ({job['name']}) failed, retrying in {delay} s:"
+                f" {error.splitlines()[-1]}"
+            )
+
+    def work(self, concurrency=1, once=False):
+        """Run due jobs until stopped, for ``flask sonic worker``.
+
+        :param once: return when no jobs are due instead of waiting
+        :return: number of jobs run
+        """
+        count = 0
+        with ThreadPoolExecutor(concurrency, thread_name_prefix="sonic-job") as pool:
+            while True:
+                ids = self.due_jobs()
+                if ids:
+                    done, _ = wait([pool.submit(self.run_job, id) for id in ids])
+                    count += sum(1 for future in done if future.result())
+                elif once:
+                    return count
+                else:
+                    time.sleep(self.poll_interval)
+
+
+@task("notify")
+def notify(content):
+    """Post a message to the ``NOTIFY_WEBHOOK_URL`` chat webhook.
+
+    Sends the same payload as ``scripts/notify_discord.sh``.
+    """
+    request = urllib.request.Request(
+        current_app.config["NOTIFY_WEBHOOK_URL"],
+        data=json.dumps({"content": content}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(
+        request, timeout=current_app.config["NOTIFY_TIMEOUT"]
+    ) as response:
+        response.read()
+
+
+def notify_later(content):
+    """Enqueue a webhook notification if ``NOTIFY_WEBHOOK_URL`` is set."""
+    if current_app.config["NOTIFY_WEBHOOK_URL"]:
+        enqueue("notify", content=content)
+
+
+def init_app(app):
+    """Create the job runner and start it with the first request."""
+    runner = app.extensions["sonic_jobs"] = JobRunner(app)
+    app.before_request(runner.start)
+    if not event.contains(db.session, "after_commit", _dispatch_jobs):
+        event.listen(db.session, "after_commit", _dispatch_jobs)
+        event.listen(db.session, "after_rollback", _forget_jobs)
@@ -0,0 +1,50 @@
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+
+def compile_templates(app):
+    """Compile every template of the app.
+
+    With a bytecode cache configured the compiled code is written to
+    disk, so later processes load it instead of parsing the templates.
+
+    :return: the number of templates compiled
+    """
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def preload_templates(app):
+    """Load every template into the app's template cache.
+
+    Called by ``create_app`` so a worker has compiled all the templates
+    before it serves a request. With ``TEMPLATES_AUTO_RELOAD`` off (the
+    default outside debug mode) loaded templates are then rendered
+    without checking the template files for changes.
+    """
+    started = time.perf_counter()
+    count = compile_templates(app)
+    app.logger.info(
+        f"Preloaded {count} templates in {(time.perf_counter() - started) * 1000:.0f} ms."
+    )
+
+
+def init_app(app):
+    """Store compiled templates in ``TEMPLATE_CACHE_DIR`` when it is set.
+
+    Jinja checks the cached code against the template source, so a stale
+    cache is never used after a template changes.
+    """
+    cache_dir = app.config["TEMPLATE_CACHE_DIR"]
+    if not cache_dir:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    # Set through the options so the environment is still created lazily.
+    app.jinja_options = {
+        **app.jinja_options,
+        "bytecode_cache": FileSystemBytecodeCache(cache_dir),
+    }
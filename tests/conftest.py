@@ -7,6 +7,14 @@ from _pytest import monkeypatch
 
 from flask import Flask
 from flask.globals import request_ctx
+from flask_migrate import upgrade
+
+from sonic import create_app
+from sonic.db import init_migrate
+
+# Renamed to NOTSET in pytest 9
+NOTSET = getattr(monkeypatch, "notset", None) or monkeypatch.NOTSET
+MIGRATIONS = os.path.join(os.path.dirname(__file__), os.pardir, "migrations")
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -17,15 +25,15 @@ def _standard_os_environ():
     """
     mp = monkeypatch.MonkeyPatch()
     out = (
-        (os.environ, "FLASK_ENV_FILE", monkeypatch.notset),
-        (os.environ, "FLASK_APP", monkeypatch.notset),
-        (os.environ, "FLASK_DEBUG", monkeypatch.notset),
-        (os.environ, "FLASK_RUN_FROM_CLI", monkeypatch.notset),
-        (os.environ, "WERKZEUG_RUN_MAIN", monkeypatch.notset),
+        (os.environ, "FLASK_ENV_FILE", NOTSET),
+        (os.environ, "FLASK_APP", NOTSET),
+        (os.environ, "FLASK_DEBUG", NOTSET),
+        (os.environ, "FLASK_RUN_FROM_CLI", NOTSET),
+        (os.environ, "WERKZEUG_RUN_MAIN", NOTSET),
     )
 
     for _, key, value in out:
-        if value is monkeypatch.notset:
+        if value is NOTSET:
             mp.delenv(key, False)
         else:
             mp.setenv(key, value)
@@ -52,6 +60,34 @@ def app():
     return app
 
 
+@pytest.fixture
+def sonic_config(tmp_path):
+    """Config for :func:`sonic_app`, tests can change it before using the app."""
+    return {
+        "TESTING": True,
+        "SECRET_KEY": "test key",
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'sonic.sqlite'}",
+        "TEMPLATE_CACHE_DIR": os.fspath(tmp_path / "jinja-cache"),
+        "TASK_MODE": "eager",
+        "PASSWORD_HASH_WORKERS": 0,
+    }
+
+
+@pytest.fixture
+def sonic_app(sonic_config):
+    """The sonic app on a migrated temporary database."""
+    app = create_app(sonic_config)
+    init_migrate(app)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+    return app
+
+
+@pytest.fixture
+def sonic_client(sonic_app):
+    return sonic_app.test_client()
+
+
 @pytest.fixture
 def app_ctx(app):
     with app.app_context() as ctx:
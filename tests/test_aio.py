@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from sonic import aio
+
+pytest.importorskip("aiosqlite")
+
+
+@pytest.fixture
+def sonic_config(sonic_config):
+    sonic_config["ASYNC_VIEWS"] = True
+    return sonic_config
+
+
+def test_connection_pragmas(sonic_app):
+    async def pragma(name):
+        return (await aio.execute(text(f"PRAGMA {name}"))).scalar()
+
+    with sonic_app.app_context():
+        assert asyncio.run(pragma("busy_timeout")) == 5000
+        # NORMAL
+        assert asyncio.run(pragma("synchronous")) == 1
+        # The default, the page cache isn't set up for one query
+        assert asyncio.run(pragma("cache_size")) == -2000
+        assert asyncio.run(pragma("journal_mode")) == "wal"
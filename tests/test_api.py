@@ -0,0 +1,162 @@
+import pytest
+from sqlalchemy import text
+
+from sonic.db import assert_max_queries, db
+from sonic.hashing import get_hasher
+
+
+@pytest.fixture
+def users(sonic_app):
+    with sonic_app.app_context():
+        for name in ("alice", "bob"):
+            db.session.execute(
+                text(
+                    "INSERT INTO user (username, password, email)"
+                    " VALUES (:name, :password, :email)"
+                ),
+                {
+                    "name": name,
+                    "password": get_hasher().hash("pw"),
+                    "email": f"{name}@example.com",
+                },
+            )
+        db.session.commit()
+
+
+def _auth(client, username="alice"):
+    response = client.post(
+        "/api/v1/tokens", json={"username": username, "password": "pw"}
+    )
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json['token']}"}
+
+
+def _create(client, headers, posts):
+    response = client.post("/api/v1/posts", json={"posts": posts}, headers=headers)
+    assert response.status_code == 201, response.json
+    return response.json["ids"]
+
+
+def test_token(sonic_client, users):
+    response = sonic_client.post(
+        "/api/v1/tokens", json={"username": "alice", "password": "pw"}
+    )
+    assert response.json["expires_in"] > 0
+    response = sonic_client.post(
+        "/api/v1/tokens", json={"username": "alice", "password": "wrong"}
+    )
+    assert response.status_code == 401
+    assert response.json["error"] == "Unauthorized"
+    assert response.headers["WWW-Authenticate"].lower().startswith("bearer")
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"username": ["alice"], "password": "pw"},
+        {"username": {"a": 1}, "password": "pw"},
+        {"username": "alice", "password": 1234},
+        {"username": "alice"},
+        ["alice", "pw"],
+    ],
+)
+def test_token_bad_request(sonic_client, users, body):
+    response = sonic_client.post("/api/v1/tokens", json=body)
+    assert response.status_code == 400
+    assert "message" in response.json
+
+
+def test_login_required_json(sonic_client):
+    response = sonic_client.post("/api/v1/posts", json={"posts": [{"title": "t"}]})
+    assert response.status_code == 401
+    assert response.is_json
+    response = sonic_client.post(
+        "/api/v1/posts",
+        json={"posts": [{"title": "t"}]},
+        headers={"Authorization": "Bearer not-a-token"},
+    )
+    assert response.status_code == 401
+
+
+def test_create_in_request_order(sonic_client, users):
+    headers = _auth(sonic_client)
+    posts = [{"title": f"post {n}", "body": f"body {n}"} for n in range(20)]
+    with assert_max_queries(4):
+        ids = _create(sonic_client, headers, posts)
+    assert len(set(ids)) == 20
+    response = sonic_client.get(f"/api/v1/posts?ids={','.join(map(str, ids))}")
+    assert [post["title"] for post in response.json["posts"]] == [
+        post["title"] for post in posts
+    ]
+
+
+@pytest.mark.parametrize(
+    "post",
+    [
+        {"title": ""},
+        {"title": 1},
+        {"title": "t", "body": 1},
+        {"title": "t", "body": ["b"]},
+    ],
+)
+def test_create_bad_request(sonic_client, users, post):
+    response = sonic_client.post(
+        "/api/v1/posts", json={"posts": [post]}, headers=_auth(sonic_client)
+    )
+    assert response.status_code == 400
+
+
+def test_update_and_delete_ownership(sonic_client, users):
+    alice = _auth(sonic_client)
+    bob = _auth(sonic_client, "bob")
+    (own,) = _create(sonic_client, alice, [{"title": "mine"}])
+    (other,) = _create(sonic_client, bob, [{"title": "theirs"}])
+
+    patch = {"posts": [{"id": own, "title": "changed"}, {"id": other, "title": "x"}]}
+    assert (
+        sonic_client.patch("/api/v1/posts", json=patch, headers=alice).status_code
+        == 403
+    )
+    patch = {"posts": [{"id": own, "title": "changed"}, {"id": 999, "title": "x"}]}
+    assert (
+        sonic_client.patch("/api/v1/posts", json=patch, headers=alice).status_code
+        == 404
+    )
+    patch = {"posts": [{"id": own, "body": 5}]}
+    assert (
+        sonic_client.patch("/api/v1/posts", json=patch, headers=alice).status_code
+        == 400
+    )
+
+    patch = {"posts": [{"id": own, "title": "changed"}]}
+    assert sonic_client.patch("/api/v1/posts", json=patch, headers=alice).json == {
+        "ids": [own]
+    }
+    assert sonic_client.get(f"/api/v1/posts/{own}").json["title"] == "changed"
+
+    body = {"ids": [own, other]}
+    assert (
+        sonic_client.delete("/api/v1/posts", json=body, headers=alice).status_code
+        == 403
+    )
+    body = {"ids": [own]}
+    assert (
+        sonic_client.delete("/api/v1/posts", json=body, headers=alice).status_code
+        == 200
+    )
+    assert sonic_client.get(f"/api/v1/posts/{own}").status_code == 404
+    assert sonic_client.get(f"/api/v1/posts/{other}").status_code == 200
+
+
+def test_fields_and_ids(sonic_client, users):
+    ids = _create(sonic_client, _auth(sonic_client), [{"title": "a"}, {"title": "b"}])
+
+    response = sonic_client.get("/api/v1/posts?fields=title,created")
+    post = response.json["posts"][0]
+    assert "body" not in post
+    assert {"title", "created"} <= post.keys()
+    assert sonic_client.get("/api/v1/posts?fields=password").status_code == 400
+
+    response = sonic_client.get(f"/api/v1/posts?ids={ids[1]},999,{ids[0]}")
+    assert [post["id"] for post in response.json["posts"]] == [ids[1], ids[0]]
+    assert sonic_client.get("/api/v1/posts?ids=1,x").status_code == 400
@@ -0,0 +1,169 @@
+import html
+import re
+
+from flask import g
+from sqlalchemy import text
+
+from sonic.blog import (
+    _cache_index,
+    get_feed_state,
+    get_posts_page,
+    invalidate_feed,
+    stream_posts_page,
+)
+from sonic.cache import get_cache
+from sonic.db import db
+
+
+def _insert_posts(app, count):
+    # Without "created", like raw SQL writes, so the server default is used
+    with app.app_context():
+        db.session.execute(
+            text(
+                "INSERT INTO user (username, password, email)"
+                " VALUES ('test', 'x', 'test@example.com')"
+            )
+        )
+        for number in range(count):
+            db.session.execute(
+                text(
+                    "INSERT INTO post (title, body, author_id)"
+                    " VALUES (:title, 'body', 1)"
+                ),
+                {"title": f"post {number}"},
+            )
+        db.session.commit()
+
+
+def _insert_post(app, title):
+    with app.app_context():
+        db.session.execute(
+            text("INSERT INTO post (title, body, author_id) VALUES (:title, '', 1)"),
+            {"title": title},
+        )
+        db.session.commit()
+
+
+def test_default_created_format(sonic_app):
+    _insert_posts(sonic_app, 1)
+    with sonic_app.app_context():
+        created = db.session.execute(text("SELECT created FROM post")).scalar()
+        # Set by the server default, not rewritten by a trigger
+        triggers = db.session.execute(
+            text("SELECT name FROM sqlite_master WHERE name LIKE 'post_created%'")
+        ).all()
+    assert re.fullmatch(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{6}", created)
+    assert triggers == []
+
+
+def test_pages_with_default_created(sonic_app):
+    _insert_posts(sonic_app, 3)
+    seen = []
+    after = None
+    with sonic_app.app_context():
+        for _ in range(4):
+            page = get_posts_page(after=after, limit=1)
+            seen.extend(post.id for post in page.posts)
+            after = page.next_cursor
+            if after is None:
+                break
+    assert seen == [3, 2, 1]
+
+
+def test_older_link_with_default_created(sonic_client, sonic_app):
+    _insert_posts(sonic_app, 3)
+    seen = []
+    url = "/?per_page=1"
+    for _ in range(4):
+        page = sonic_client.get(url).get_data(as_text=True)
+        seen.extend(re.findall(r"<h1>post (\d)</h1>", page))
+        match = re.search(r'<a class="next" href="([^"]+)"', page)
+        if match is None:
+            break
+        url = html.unescape(match.group(1))
+    assert seen == ["2", "1", "0"]
+
+
+def test_invalidate_feed(sonic_client, sonic_app):
+    _insert_posts(sonic_app, 1)
+    assert "post 0" in sonic_client.get("/").get_data(as_text=True)
+    _insert_post(sonic_app, "post 1")
+    # Served from the page cache until invalidated
+    assert "post 1" not in sonic_client.get("/").get_data(as_text=True)
+    with sonic_app.app_context():
+        invalidate_feed()
+    assert "post 1" in sonic_client.get("/").get_data(as_text=True)
+
+
+def test_late_render_not_cached(sonic_client, sonic_app):
+    with sonic_app.test_request_context("/"):
+        g.user = None
+        version = get_feed_state()[0]
+        invalidate_feed()
+        # A page rendered before the invalidation is stored after it
+        _cache_index(version, "stale")
+    assert sonic_client.get("/").get_data(as_text=True) != "stale"
+
+
+def test_not_modified(sonic_client, sonic_app):
+    response = sonic_client.get("/")
+    etag = response.headers["ETag"]
+    response = sonic_client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    with sonic_app.app_context():
+        invalidate_feed()
+    response = sonic_client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_invalidate_fragments(sonic_client, sonic_app):
+    _insert_posts(sonic_app, 2)
+    sonic_client.get("/")
+    with sonic_app.app_context():
+        fragments = get_cache("fragment")
+        fragments.set((1, True), "author")
+        assert fragments.get((1, False)) is not None
+        invalidate_feed(1)
+        assert fragments.get((1, True)) is None
+        assert fragments.get((1, False)) is None
+        assert fragments.get((2, False)) is not None
+
+
+def test_stream_cursors_after_iteration(sonic_app):
+    _insert_posts(sonic_app, 5)
+    with sonic_app.test_request_context():
+        page = stream_posts_page(limit=2)
+        # Only known once the rows have been read
+        assert page.next_cursor is None
+        assert [post.id for post in page.posts] == [5, 4]
+        assert page.prev_cursor is None
+        assert page.next_cursor == get_posts_page(limit=2).next_cursor
+
+        page = stream_posts_page(after=page.next_cursor, limit=2)
+        assert [post.id for post in page.posts] == [3, 2]
+        expected = get_posts_page(after=page.after, limit=2)
+        assert page.prev_cursor is not None
+        assert page.prev_cursor == expected.prev_cursor
+        assert page.next_cursor is not None
+        assert page.next_cursor == expected.next_cursor
+
+
+def test_stream_closed_on_early_exit(sonic_app):
+    _insert_posts(sonic_app, 3)
+    with sonic_app.test_request_context():
+        page = stream_posts_page(limit=3)
+        posts = page.posts
+        assert next(posts).id == 3
+        posts.close()
+        assert page.result.closed
+
+
+def test_streamed_page_size_capped(sonic_client, sonic_app):
+    sonic_app.config["POSTS_PER_PAGE_MAX"] = 2
+    _insert_posts(sonic_app, 3)
+    page = sonic_client.get("/?stream=1&per_page=50").get_data(as_text=True)
+    assert re.findall(r"<h1>post (\d)</h1>", page) == ["2", "1"]
+    assert '<a class="next"' in page
+    assert sonic_client.get("/?stream=1&per_page=0").status_code == 400
@@ -0,0 +1,29 @@
+from sonic.cache import InvalidationBus, TTLCache
+
+
+def test_version_changes_on_clear():
+    cache = TTLCache()
+    version = cache.version()
+    assert cache.version() == version
+    cache.delete("key")
+    assert cache.version() == version
+    cache.clear()
+    assert cache.version() != version
+    assert TTLCache().version() != cache.version()
+
+
+def test_processes_agree_on_version():
+    # Caches of the same name in two processes, sharing the bus
+    bus = InvalidationBus(size=8)
+    first = TTLCache(bus=bus, name="page")
+    second = TTLCache(bus=bus, name="page")
+    other = TTLCache(bus=bus, name="user")
+    assert first.version() == second.version()
+
+    version = first.version()
+    other.clear()
+    assert first.version() == version
+    second.set("feed", "old")
+    first.clear()
+    assert second.get("feed") is None
+    assert first.version() == second.version() != version
@@ -0,0 +1,120 @@
+import json
+
+import pytest
+from flask_migrate import upgrade
+from sqlalchemy import text
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from conftest import MIGRATIONS
+from sonic import create_app
+from sonic.cli import export, import_
+from sonic.db import db, init_migrate
+
+
+@pytest.fixture
+def target_app(sonic_config, tmp_path):
+    """A second, empty app to import into."""
+    config = dict(sonic_config)
+    config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'target.sqlite'}"
+    app = create_app(config)
+    init_migrate(app)
+    with app.app_context():
+        upgrade(directory=MIGRATIONS)
+    return app
+
+
+def _rows(app, sql):
+    with app.app_context():
+        return [tuple(row) for row in db.session.execute(text(sql))]
+
+
+def _invoke(app, command, args):
+    result = app.test_cli_runner().invoke(command, args)
+    assert result.exit_code == 0, result.output
+    return result
+
+
+@pytest.mark.parametrize("extension", ["ndjson", "csv"])
+def test_round_trip(sonic_app, target_app, tmp_path, extension):
+    with sonic_app.app_context():
+        for number in range(3):
+            db.session.execute(
+                text(
+                    "INSERT INTO user (username, password, email)"
+                    " VALUES (:name, :password, :email)"
+                ),
+                {
+                    "name": f"user{number}",
+                    "password": generate_password_hash("pw", "pbkdf2:sha256:1000"),
+                    "email": f"user{number}@example.com",
+                },
+            )
+        for number in range(5):
+            db.session.execute(
+                text(
+                    "INSERT INTO post (title, body, author_id)"
+                    " VALUES (:title, 'a body, with \"quotes\"', :author_id)"
+                ),
+                {"title": f"zebra {number}", "author_id": number % 3 + 1},
+            )
+        db.session.commit()
+
+    users = tmp_path / f"users.{extension}"
+    posts = tmp_path / f"posts.{extension}"
+    _invoke(sonic_app, export, ["users", str(users)])
+    _invoke(sonic_app, export, ["posts", str(posts)])
+    _invoke(target_app, import_, ["users", str(users), "--hash-workers", "1"])
+    _invoke(target_app, import_, ["posts", str(posts), "--batch-size", "2"])
+
+    user_sql = "SELECT id, username, email, password FROM user ORDER BY id"
+    assert _rows(target_app, user_sql) == _rows(sonic_app, user_sql)
+    post_sql = (
+        "SELECT id, author_id, author_username, created, title, body"
+        " FROM post ORDER BY id"
+    )
+    assert _rows(target_app, post_sql) == _rows(sonic_app, post_sql)
+
+    # The search trigger is back and the index has the imported posts
+    assert _rows(
+        target_app,
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name = 'post_fts_ai'",
+    ) == [("post_fts_ai",)]
+    assert (
+        len(
+            _rows(target_app, "SELECT rowid FROM post_fts WHERE post_fts MATCH 'zebra'")
+        )
+        == 5
+    )
+
+
+def test_import_plain_passwords(target_app, tmp_path):
+    users = tmp_path / "users.ndjson"
+    users.write_text(
+        json.dumps({"username": "plain", "email": "p@example.com", "password": "pw"})
+        + "\n"
+        + json.dumps(
+            {
+                "username": "hashed",
+                "email": "h@example.com",
+                "password_hash": generate_password_hash("other"),
+            }
+        )
+        + "\n"
+    )
+    _invoke(target_app, import_, ["users", str(users), "--hash-workers", "1"])
+
+    (plain, hashed) = _rows(target_app, "SELECT password FROM user ORDER BY id")
+    assert check_password_hash(plain[0], "pw")
+    assert plain[0].startswith(target_app.config["PASSWORD_HASH_METHOD"])
+    assert check_password_hash(hashed[0], "other")
+
+
+def test_import_requires_a_password(target_app, tmp_path):
+    users = tmp_path / "users.csv"
+    users.write_text("username,email,password\nnobody,n@example.com,\n")
+    result = target_app.test_cli_runner().invoke(
+        import_, ["users", str(users), "--hash-workers", "1"]
+    )
+    assert result.exit_code == 1
+    assert "Every user needs a password or password_hash." in result.output
+    assert _rows(target_app, "SELECT id FROM user") == []
@@ -0,0 +1,67 @@
+import pytest
+from flask import g
+from sqlalchemy import text
+
+from sonic.auth import get_user_identity
+from sonic.blog import get_post
+from sonic.cli import replicate
+from sonic.db import QueryTracker, db, get_db, get_read_db
+from sonic.hashing import get_hasher
+
+
+@pytest.fixture
+def sonic_config(sonic_config, tmp_path):
+    sonic_config["SQLALCHEMY_READ_URI"] = f"sqlite:///{tmp_path / 'replica.sqlite'}"
+    return sonic_config
+
+
+@pytest.fixture
+def replica_app(sonic_app):
+    # The replica has the schema, but not the rows written below
+    result = sonic_app.test_cli_runner().invoke(replicate)
+    assert result.exit_code == 0, result.output
+    with sonic_app.app_context():
+        db.session.execute(
+            text(
+                "INSERT INTO user (username, password, email)"
+                " VALUES ('test', :password, 'test@example.com')"
+            ),
+            {"password": get_hasher().hash("pw")},
+        )
+        db.session.execute(
+            text("INSERT INTO post (title, body, author_id) VALUES ('new', '', 1)")
+        )
+        db.session.commit()
+    return sonic_app
+
+
+def test_read_falls_back_to_primary(replica_app):
+    with replica_app.test_request_context():
+        assert get_read_db() is not get_db()
+        assert get_user_identity(1) == {"id": 1, "username": "test"}
+        assert get_post(1, check_author=False).title == "new"
+
+
+def test_login_keeps_read_stickiness(replica_app, sonic_client):
+    with sonic_client.session_transaction() as session:
+        session["db_wrote_at"] = 1.0
+    sonic_client.post("/auth/login", data={"username": "test", "password": "pw"})
+    with sonic_client.session_transaction() as session:
+        assert session["user_id"] == 1
+        assert session["db_wrote_at"] == 1.0
+
+
+def test_duplicates_tracked_only_when_reported(sonic_app):
+    with sonic_app.app_context():
+        db.session.execute(text("SELECT 1"))
+        db.session.execute(text("SELECT 1"))
+        # No headers and no tracker, so nothing reports duplicates
+        assert "db_query_seen" not in g
+
+        with QueryTracker():
+            db.session.execute(text("SELECT 1"))
+            db.session.execute(text("SELECT 1"))
+            rows = [{"id": 1}, {"id": 2}]
+            db.session.execute(text("DELETE FROM post WHERE id = :id"), rows)
+            db.session.execute(text("DELETE FROM post WHERE id = :id"), rows)
+        assert g.db_query_duplicates == 1
@@ -0,0 +1,81 @@
+import logging
+
+import pytest
+from sqlalchemy import text
+
+from sonic.db import (
+    QueryBudgetExceeded,
+    QueryTracker,
+    assert_max_queries,
+    db,
+    get_db,
+    query_budget,
+)
+
+
+def _query(count):
+    for _ in range(count):
+        get_db().execute(text("SELECT 1"))
+
+
+def test_tracker_records_statements(sonic_app):
+    with sonic_app.app_context(), QueryTracker() as tracker:
+        _query(2)
+    assert tracker.count == 2
+    assert tracker.statements == ["SELECT 1", "SELECT 1"]
+
+
+def test_assert_max_queries(sonic_app):
+    with sonic_app.app_context():
+        with assert_max_queries(2):
+            _query(2)
+        with pytest.raises(QueryBudgetExceeded, match="3 queries run, the budget is 2"):
+            with assert_max_queries(2):
+                _query(3)
+
+
+@pytest.fixture
+def budget_app(sonic_app):
+    @sonic_app.route("/over-budget")
+    @query_budget(1)
+    def over_budget():
+        _query(2)
+        return ""
+
+    return sonic_app
+
+
+def test_query_budget_strict(budget_app):
+    with pytest.raises(QueryBudgetExceeded, match="over_budget ran 2 queries"):
+        budget_app.test_client().get("/over-budget")
+
+
+def test_query_budget_warns(budget_app, caplog):
+    budget_app.config["QUERY_BUDGET_STRICT"] = False
+    with caplog.at_level(logging.WARNING):
+        assert budget_app.test_client().get("/over-budget").status_code == 200
+    assert "over_budget ran 2 queries, the budget is 1." in caplog.text
+
+
+@pytest.mark.parametrize("user_id", [None, 1])
+def test_index_within_budget(sonic_app, user_id):
+    with sonic_app.app_context():
+        db.session.execute(
+            text(
+                "INSERT INTO user (username, password, email)"
+                " VALUES ('test', 'x', 'test@example.com')"
+            )
+        )
+        for number in range(5):
+            db.session.execute(
+                text("INSERT INTO post (title, body, author_id) VALUES (:t, '', 1)"),
+                {"t": f"post {number}"},
+            )
+        db.session.commit()
+
+    client = sonic_app.test_client()
+    if user_id is not None:
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+    with assert_max_queries(2):
+        assert client.get("/").status_code == 200
@@ -0,0 +1,15 @@
+from sonic.cli import check_listing_plans, check_plans
+
+
+def test_listing_queries_use_indexes(sonic_app):
+    with sonic_app.app_context():
+        plans = check_listing_plans()
+    assert plans
+    problems = {name: steps for name, (steps, problems) in plans.items() if problems}
+    assert problems == {}
+
+
+def test_check_plans_command(sonic_app):
+    result = sonic_app.test_cli_runner().invoke(check_plans)
+    assert result.exit_code == 0, result.output
+    assert "FAIL" not in result.output
@@ -0,0 +1,32 @@
+import pytest
+
+LOGIN = {"username": "nobody", "password": "x"}
+
+
+def _login(client, forwarded=None):
+    headers = {"X-Forwarded-For": forwarded} if forwarded else {}
+    return client.post("/auth/login", data=LOGIN, headers=headers).status_code
+
+
+def test_forwarded_for_ignored_by_default(sonic_client):
+    # 10 logins per minute, whatever address the client claims
+    codes = [_login(sonic_client, f"10.0.0.{n}") for n in range(11)]
+    assert codes == [200] * 10 + [429]
+
+
+@pytest.fixture(params=[1, 2])
+def hops(request, sonic_config):
+    sonic_config["RATELIMIT_PROXY_HOPS"] = request.param
+    return request.param
+
+
+def test_trusted_proxy_hops(hops, sonic_client):
+    proxies = ", 192.168.0.1" * (hops - 1)
+
+    # Spoofed entries before the proxy's are ignored
+    codes = [
+        _login(sonic_client, f"10.0.0.{n}, 203.0.113.1{proxies}") for n in range(11)
+    ]
+    assert codes == [200] * 10 + [429]
+    # Another client behind the same proxy has its own bucket
+    assert _login(sonic_client, f"203.0.113.2{proxies}") == 200
@@ -0,0 +1,46 @@
+import os
+
+from sonic import prefork, requestlog
+
+
+def test_listener_restarts_after_fork(sonic_client, monkeypatch):
+    # A forked worker inherits the handler and queue, but not the thread
+    monkeypatch.setattr(requestlog, "_listener_pid", -1)
+    inherited = requestlog._listener
+
+    assert sonic_client.get("/version").status_code == 200
+    assert requestlog._listener_pid == os.getpid()
+    assert requestlog._listener is not inherited
+    (handler,) = requestlog.logger.handlers
+    assert handler.queue is requestlog._listener.queue
+    inherited.stop()
+
+
+def test_listener_stopped_while_forking(sonic_app, monkeypatch):
+    running = []
+
+    def fork():
+        running.append(requestlog._listener._thread)
+        return 12345
+
+    monkeypatch.setattr(prefork.os, "fork", fork)
+    arbiter = prefork.Arbiter(sonic_app, None, 1)
+    arbiter.spawn()
+
+    assert running == [None]
+    assert arbiter.pids == {12345}
+    # The parent has a running listener again
+    assert requestlog._listener_pid == os.getpid()
+    assert requestlog._listener._thread.is_alive()
+
+
+def test_requests_log_only_through_the_queue(sonic_client, caplog, capsys):
+    sonic_client.get("/")
+    caplog.set_level("INFO")
+    capsys.readouterr()
+
+    assert sonic_client.get("/version").status_code == 200
+    assert sonic_client.get("/").status_code == 200
+    # Nothing is written by the request thread for a cached page
+    assert [r for r in caplog.records if r.name == "sonic"] == []
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,67 @@
+from sqlalchemy import text
+
+from sonic.db import db
+from sonic.search import search_posts
+
+
+def _insert_posts(app, posts):
+    with app.app_context():
+        db.session.execute(
+            text(
+                "INSERT INTO user (username, password, email)"
+                " VALUES ('test', 'x', 'test@example.com')"
+            )
+        )
+        for title, body in posts:
+            db.session.execute(
+                text(
+                    "INSERT INTO post (title, body, author_id)"
+                    " VALUES (:title, :body, 1)"
+                ),
+                {"title": title, "body": body},
+            )
+        db.session.commit()
+
+
+def test_title_matches_rank_first(sonic_app):
+    _insert_posts(
+        sonic_app,
+        [
+            ("first", "an apple a day"),
+            ("apple pie", "with cinnamon"),
+            ("last", "apple, apple and more apple"),
+        ],
+    )
+    with sonic_app.test_request_context():
+        results, has_next = search_posts("apple")
+    assert [result["id"] for result in results][0] == 2
+    assert sorted(result["id"] for result in results) == [1, 2, 3]
+    assert not has_next
+
+
+def test_pages(sonic_app):
+    _insert_posts(sonic_app, [(f"post {number}", "apple") for number in range(5)])
+    seen = []
+    with sonic_app.test_request_context():
+        for page in (1, 2, 3):
+            results, has_next = search_posts("apple", page, per_page=2)
+            seen.extend(result["id"] for result in results)
+            assert has_next == (page < 3)
+    assert sorted(seen) == [1, 2, 3, 4, 5]
+
+
+def test_highlight_escapes_post_text(sonic_client, sonic_app):
+    _insert_posts(
+        sonic_app,
+        [("<b>apple</b>", "\x02<script>x</script>\x03 apple \x02planted\x03")],
+    )
+    with sonic_app.test_request_context():
+        (result,) = search_posts("apple")[0]
+    assert result["title"] == "&lt;b&gt;<mark>apple</mark>&lt;/b&gt;"
+    assert result["snippet"] == (
+        "&lt;script&gt;x&lt;/script&gt; <mark>apple</mark> planted"
+    )
+
+    page = sonic_client.get("/search?q=apple").get_data(as_text=True)
+    assert "&lt;script&gt;" in page
+    assert "<script>" not in page
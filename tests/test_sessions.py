@@ -0,0 +1,114 @@
+import pytest
+from sqlalchemy import text
+
+from sonic.auth import invalidate_user
+from sonic.cli import revoke_sessions_command
+from sonic.db import QueryTracker, db
+from sonic.hashing import get_hasher
+
+
+@pytest.fixture
+def sonic_config(sonic_config):
+    sonic_config["SESSION_BACKEND"] = "sqlite"
+    return sonic_config
+
+
+@pytest.fixture
+def user(sonic_app):
+    with sonic_app.app_context():
+        db.session.execute(
+            text(
+                "INSERT INTO user (username, password, email)"
+                " VALUES ('test', :password, 'test@example.com')"
+            ),
+            {"password": get_hasher().hash("pw")},
+        )
+        db.session.commit()
+    return 1
+
+
+def _login(client):
+    response = client.post("/auth/login", data={"username": "test", "password": "pw"})
+    assert response.status_code == 302
+    return response
+
+
+def _stored(app, sql="SELECT user_id, identity FROM session"):
+    with app.app_context():
+        return db.session.execute(text(sql)).fetchall()
+
+
+def test_token_rotates_on_login(sonic_app, sonic_client, user):
+    with sonic_client.session_transaction() as session:
+        session["theme"] = "dark"
+    before = sonic_client.get_cookie("session").value
+
+    _login(sonic_client)
+    after = sonic_client.get_cookie("session").value
+    assert after != before
+    # The old token no longer exists, only the logged in session
+    ((user_id, identity),) = _stored(sonic_app)
+    assert user_id == user
+    assert identity is not None
+
+
+def test_logout_deletes_session(sonic_app, sonic_client, user):
+    _login(sonic_client)
+    response = sonic_client.get("/auth/logout")
+    assert "session=;" in response.headers["Set-Cookie"]
+    assert sonic_client.get_cookie("session") is None
+    assert _stored(sonic_app) == []
+
+
+def test_revoke_sessions(sonic_app, sonic_client, user):
+    _login(sonic_client)
+    other = sonic_app.test_client()
+    _login(other)
+    assert len(_stored(sonic_app)) == 2
+
+    result = sonic_app.test_cli_runner().invoke(revoke_sessions_command, ["test"])
+    assert result.exit_code == 0, result.output
+    assert "Revoked 2 sessions of test." in result.output
+    assert _stored(sonic_app) == []
+    assert "Log Out" not in sonic_client.get("/").get_data(as_text=True)
+
+
+def test_invalidate_user_forgets_identity(sonic_app, sonic_client, user):
+    _login(sonic_client)
+    with sonic_app.app_context():
+        invalidate_user(user)
+    assert _stored(sonic_app) == [(user, None)]
+
+    # The next request loads the identity and stores it again
+    assert "test" in sonic_client.get("/").get_data(as_text=True)
+    ((_, identity),) = _stored(sonic_app)
+    assert identity is not None
+
+
+def test_vary_and_cookie(sonic_client, user):
+    # Anonymous pages depend on the cookie too, but don't start a session
+    response = sonic_client.get("/")
+    assert "Cookie" in response.vary
+    assert "Set-Cookie" not in response.headers
+
+    response = _login(sonic_client)
+    assert "Cookie" in response.vary
+    assert "HttpOnly" in response.headers["Set-Cookie"]
+
+    # An unchanged session is neither written nor sent again
+    response = sonic_client.get("/")
+    assert "Cookie" in response.vary
+    assert "Set-Cookie" not in response.headers
+
+
+def test_login_keeps_other_sessions(sonic_app, sonic_client, user):
+    _login(sonic_client)
+    other = sonic_app.test_client()
+    with QueryTracker() as tracker:
+        _login(other)
+        other.get("/auth/logout")
+    assert not any("UPDATE session" in s for s in tracker.statements)
+    # The first session still has its identity
+    ((user_id, identity),) = _stored(sonic_app)
+    assert user_id == user
+    assert identity is not None
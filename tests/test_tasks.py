@@ -0,0 +1,138 @@
+import logging
+
+import pytest
+from sqlalchemy import text
+
+from sonic import create_app
+from sonic.db import QueryTracker, db
+from sonic.tasks import enqueue, task
+
+calls = []
+
+
+@task("test_record")
+def record(value):
+    calls.append(value)
+
+
+@task("test_fail", max_attempts=3)
+def fail():
+    raise RuntimeError("boom")
+
+
+@pytest.fixture(autouse=True)
+def _reset_calls():
+    calls.clear()
+
+
+def _jobs(app):
+    with app.app_context():
+        return db.session.execute(
+            text("SELECT name, status, attempts, last_error FROM job")
+        ).fetchall()
+
+
+def test_runs_after_commit(sonic_app):
+    with sonic_app.app_context():
+        enqueue("test_record", value=1)
+        assert calls == []
+        db.session.commit()
+        assert calls == [1]
+    # Done jobs are deleted
+    assert _jobs(sonic_app) == []
+
+
+def test_rollback_drops_job(sonic_app):
+    with sonic_app.app_context():
+        enqueue("test_record", value=1)
+        db.session.rollback()
+        db.session.execute(text("SELECT 1"))
+        db.session.commit()
+    assert calls == []
+    assert _jobs(sonic_app) == []
+
+
+def test_retry_with_backoff(sonic_app):
+    runner = sonic_app.extensions["sonic_jobs"]
+    runner.retry_delay = 10
+    runner.mode = "worker"
+    with sonic_app.app_context():
+        job_id = enqueue("test_fail")
+        db.session.commit()
+
+    delays = []
+    for attempt in range(3):
+        assert runner.run_job(job_id)
+        with sonic_app.app_context():
+            delays.append(
+                db.session.execute(
+                    text(
+                        "SELECT round((julianday(run_at) - julianday('now')) * 86400)"
+                        " FROM job WHERE id = :id"
+                    ),
+                    {"id": job_id},
+                ).scalar()
+            )
+            # Make it due again
+            db.session.execute(
+                text("UPDATE job SET run_at = datetime('now', '-1 second')")
+            )
+            db.session.commit()
+
+    # datetime('now') has whole seconds
+    assert 9 <= delays[0] <= 10
+    assert 19 <= delays[1] <= 20
+    ((name, status, attempts, error),) = _jobs(sonic_app)
+    assert (status, attempts) == ("failed", 3)
+    assert "RuntimeError: boom" in error
+    # Failed jobs aren't run again
+    assert not runner.run_job(job_id)
+    with sonic_app.app_context():
+        assert runner.due_jobs() == []
+
+
+def test_poll_reads_only(sonic_app):
+    runner = sonic_app.extensions["sonic_jobs"]
+    with sonic_app.app_context():
+        db.session.execute(
+            text(
+                "INSERT INTO job (name, payload, max_attempts, status, locked_at)"
+                " VALUES ('test_record', '{\"value\": 2}', 3, 'running',"
+                " datetime('now', '-1 hour'))"
+            )
+        )
+        db.session.commit()
+
+    # A stale running job is made pending and found
+    assert len(runner.due_jobs()) == 1
+    assert runner.run_job(runner.due_jobs()[0])
+    assert calls == [2]
+
+    # Without jobs, polling doesn't write
+    with QueryTracker() as tracker:
+        assert runner.due_jobs() == []
+    assert tracker.count == 2
+    assert all(statement.startswith("SELECT") for statement in tracker.statements)
+
+
+class _Stop(BaseException):
+    pass
+
+
+def test_poller_logs_once(sonic_config, caplog, monkeypatch):
+    # No migrations, so there is no job table
+    app = create_app(sonic_config)
+    runner = app.extensions["sonic_jobs"]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 3:
+            raise _Stop
+
+    monkeypatch.setattr("sonic.tasks.time.sleep", sleep)
+    with caplog.at_level(logging.ERROR), pytest.raises(_Stop):
+        runner._poll()
+    failures = [r for r in caplog.records if r.message == "Polling for jobs failed."]
+    assert len(failures) == 1
+    assert runner._pool is None